@@ -1,28 +1,193 @@
 # Plattsalat specific python macros
-import collections
-import datetime
-import numbers
-import types
-import logging
-import uno
-from bodb import Query, mkcctx
-from com.sun.star.lang import Locale
-from com.sun.star.table.CellVertJustify import CENTER as vertCenter
-from com.sun.star.table.CellHoriJustify import CENTER as horCenter
-from com.sun.star.table.CellHoriJustify import RIGHT as horRight
-from com.sun.star.table.CellHoriJustify import LEFT as horLeft
-from com.sun.star.table import CellRangeAddress
+import time
+# The imports below are part of the import time measured at the end
+# of this module, so they come after the start is taken.
+_importStarted = time.perf_counter()
+import datetime  # noqa: E402
+import functools  # noqa: E402
+import os  # noqa: E402
+import types  # noqa: E402
+import layout  # noqa: E402
+import unores  # noqa: E402
+from bodb import Query, mkcctx, useCache, userProfile  # noqa: E402
+try:
+	import uno
+	from com.sun.star.beans import PropertyValue
+	from com.sun.star.table import CellAddress, CellRangeAddress
+except ImportError:
+	# Plain python, only the sheets of odsheet can be created
+	uno = None
+
+# Seconds importing this module may take, see the end of it. Constants
+# are resolved when first used (see unores), and modules only needed
+# by some macros are imported by them.
+ImportBudget = 0.05
 
 
 def do_log(fname='/home/nils/tmp/oodebug.log'):
 	global log
+	import logging
 
 	logging.basicConfig(filename=fname)
 	log = logging.getLogger('libreoffice')
 	log.setLevel(logging.DEBUG)
 
 
-Pos = collections.namedtuple('Pos', 'x y')
+def do_profile(fname='/home/nils/tmp/ooprofile.jsonl'):
+	"""Log phase timings and UNO calls of every report, see psprof
+
+	One JSON line per report run is appended to fname. Also switched
+	on by the environment variable PS_PROFILE naming the file.
+	"""
+	import psprof
+	psprof.enable(globals(), fname)
+
+
+# When running in batch mode (see psbatch.py), documents are created
+# without a window and collected in documents to be exported.
+batchMode = False
+documents = []
+
+# Port of the worker running the reports of the menu, see psdaemon.py
+# and viaWorker. None runs them in this process. Set by the environment
+# variable PS_WORKER_PORT, as asking for a worker that is not there
+# takes a while on some systems.
+WorkerPort = None
+if os.environ.get('PS_WORKER_PORT'):
+	WorkerPort = int(os.environ['PS_WORKER_PORT'])
+
+# Documents of earlier runs the next Sheets update instead of creating
+# new ones, in order, see Sheet.open
+toUpdate = []
+
+# Name of the document property holding what the data block of a
+# sheet was made from, see Sheet.dataKey
+LayoutProperty = 'PsLayout'
+
+# Beyond this many changed cells, a refresh rewrites the whole grid
+RefreshLimit = 50
+
+# Report template providing the named styles, see defineStyles.
+# Without it, the styles are created in each new document. None
+# looks next to this file, see templatePath.
+Template = None
+
+
+def templatePath():
+	"""Path of the report template, psreport.ots next to this file
+
+	The script provider of LibreOffice may give __file__ as a file
+	URL, or not at all. Then the file is taken to be in the python
+	scripts of the user profile.
+	"""
+	global Template
+	if Template is None:
+		path = globals().get('__file__', '')
+		if path.startswith('file:'):
+			path = uno.fileUrlToSystemPath(path)
+		if path:
+			directory = os.path.dirname(path)
+		else:
+			directory = os.path.join(userProfile(), 'Scripts', 'python')
+		Template = os.path.join(directory, 'psreport.ots')
+	return Template
+
+
+# Properties of the page style PS Report, see defineStyles
+ReportPage = dict(
+	LeftMargin=500, TopMargin=500, BottomMargin=500, RightMargin=500,
+	HeaderIsOn=False, FooterIsOn=False,
+	CenterHorizontally=True, CenterVertically=False
+)
+
+
+def defineStyles(calc):
+	"""Create the named styles of our reports in the document calc
+
+	These are the styles the report template provides, see
+	writeTemplate. Existing styles are left alone.
+	"""
+	bold = unores.fontWeight('BOLD')
+	currency = unores.numberFormat(calc, 'CURRENCY')
+	# Use a 12pt Font Size by default
+	calc.StyleFamilies.CellStyles.getByName('Default').CharHeight = 12
+	styles = {
+		'CellStyles': {
+			'PS Bold': dict(CharWeight=bold),
+			'PS Price': dict(NumberFormat=currency),
+			'PS Unit': dict(CharWeight=bold),
+		},
+		'PageStyles': {
+			'PS Report': ReportPage,
+		},
+	}
+	for family, defs in styles.items():
+		service = 'com.sun.star.style.' + family[:-1]
+		family = calc.StyleFamilies.getByName(family)
+		for name, props in defs.items():
+			if family.hasByName(name): continue
+			style = calc.createInstance(service)
+			family.insertByName(name, style)
+			for prop, value in props.items():
+				setattr(style, prop, value)
+
+
+def copyPageStyle(calc, name, base='PS Report'):
+	"""Create the page style name in calc like base, returns name
+
+	The scale is part of the page style, so every sheet of a workbook
+	needs one of its own. An existing style name is left alone.
+	"""
+	family = calc.StyleFamilies.PageStyles
+	if not family.hasByName(name):
+		style = calc.createInstance('com.sun.star.style.PageStyle')
+		family.insertByName(name, style)
+		base = family.getByName(base)
+		for prop in ReportPage:
+			setattr(style, prop, getattr(base, prop))
+	return name
+
+
+def writeTemplate(path):
+	"""Save a document with our named styles as report template"""
+	desktop = XSCRIPTCONTEXT.getDesktop()
+	calc = desktop.loadComponentFromURL(
+		"private:factory/scalc", "_blank", 0,
+		(PropertyValue(Name='Hidden', Value=True),)
+	)
+	defineStyles(calc)
+	calc.storeToURL(
+		uno.systemPathToFileUrl(os.path.abspath(path)),
+		(PropertyValue(Name='FilterName', Value='calc8_template'),)
+	)
+	calc.close(True)
+
+
+def viaWorker(func):
+	"""Let the worker daemon run the report func, if there is one
+
+	The worker keeps its connections and caches from click to click,
+	see psdaemon. The macro only queues the job and returns, the
+	worker creates the document once LibreOffice is idle again.
+	Without a worker, and in batch mode, func runs right here.
+	"""
+	@functools.wraps(func)
+	def run(*args):
+		if WorkerPort is not None and not batchMode:
+			import psdaemon
+			try:
+				psdaemon.submit(func.__name__, WorkerPort)
+				return None
+			except (OSError, ValueError):
+				# No worker, or an older one not knowing func
+				pass
+		return func(*args)
+	return run
+
+
+def unitCapitalized(lst):
+	"""Copy of the query result lst with consistent unit capitalization"""
+	return [r._replace(VKEinheit=r.VKEinheit.capitalize()) for r in lst]
 
 
 class ColumnDef(types.SimpleNamespace):
@@ -35,8 +200,8 @@ class ColumnDef(types.SimpleNamespace):
 	- tryOptWidth (boolean) First try to set the width to its optimum
 	. value. Only if that is too big, set it to the given width
 	- bold (boolean) set typeface to bold
-	- greyUnit (boolean) set background to grey if the text appears
-	. to represent discrete units
+	- greyUnit (boolean) emphasize the text (style PS Unit) if it
+	. represents discrete units, see layout.isPieceUnit
 	- hcenter (boolean) Center horizontally
 	- hright (boolean) Align on the right
 
@@ -58,41 +223,230 @@ class ColumnDef(types.SimpleNamespace):
 		super().__init__(**opts)
 
 
-class Sheet:
-	"""A single sheet to be filled with tables"""
+class Sheet(layout.BaseSheet):
+	"""A single sheet to be filled with tables
+
+	Given a book, another Sheet, the sheet is added to the document of
+	that one instead of a new document, see add.
+	"""
+
+	# Measured row heights, see rowRuns
+	rowHeights = {}
+
+	def __init__(self, name, cols, titlerows=0, book=None):
+		super().__init__(name, cols, titlerows, book)
+		# What the data of a document opened for update was made from,
+		# and whether only its values were refreshed, see addData
+		self.stored = None
+		self.refreshed = False
+		# The document property holding the dataKey of this sheet,
+		# and whether the document has it, see storeKey
+		self.layoutProperty = LayoutProperty
+		self.keyStored = False
+		if book is not None:
+			self.add(book)
+		elif toUpdate:
+			self.open(toUpdate.pop(0))
+		else:
+			self.create()
+		self.Linestyle = unores.borderLine(5)
+		self.Boldface = unores.fontWeight('BOLD')
 
-	def __init__(self, name, cols, titlerows=0):
+	def load(self, url, props):
 		desktop = XSCRIPTCONTEXT.getDesktop()
-		# Create a new calc and use its first sheet
-		self.calc = desktop.loadComponentFromURL(
-			"private:factory/scalc", "_blank", 0, ()
-		)
+		if batchMode:
+			props.append(PropertyValue(Name='Hidden', Value=True))
+		self.calc = desktop.loadComponentFromURL(url, "_blank", 0, tuple(props))
+		if batchMode:
+			documents.append(self.calc)
 		self.sheet = self.calc.Sheets.getByIndex(0)
-		self.sheet.Name = name
-		self.cols = cols
-		self.titlerows = titlerows
-		self.currencyformat = self.calc.NumberFormats.getStandardFormat(
-			uno.getConstantByName("com.sun.star.util.NumberFormat.CURRENCY"),
-			Locale('de', 'DE', '')
-		)
-		self.Linestyle = uno.createUnoStruct("com.sun.star.table.BorderLine2")
-		self.Linestyle.OuterLineWidth = 5
-		self.ColDefs = []
-		self.Boldface = uno.getConstantByName("com.sun.star.awt.FontWeight.BOLD")
-		# Get the default cell style
-		# and use it to set use a 12pt Font Size by default
-		cs = self.calc.StyleFamilies.CellStyles.getByName('Default')
-		cs.CharHeight = 12
-
-	def addColumns(self, cols):
-		self.ColDefs += cols
+		# Position of the sheet in the document, see rangeAddress, and
+		# the number of sheets of the workbook so far, see add
+		self.sheetIndex = 0
+		self.sheetCount = 1
+
+	def create(self):
+		# Create a new calc, from our template if there is one,
+		# and use its first sheet
+		if os.path.exists(templatePath()):
+			self.load(
+				uno.systemPathToFileUrl(os.path.abspath(Template)),
+				[PropertyValue(Name='AsTemplate', Value=True)]
+			)
+		else:
+			self.load("private:factory/scalc", [])
+			defineStyles(self.calc)
+		self.sheet.Name = self.name
+		self.sheet.PageStyle = 'PS Report'
+
+	def add(self, book):
+		"""Add the sheet to the document of the sheet book
+
+		It gets a page style of its own, made like PS Report, and comes
+		after the sheets added before. In a document opened for update,
+		the sheet of the same name is updated, see addData, and moved
+		there if need be.
+		"""
+		self.calc = book.calc
+		self.layoutProperty = f'{LayoutProperty} {self.name}'
+		self.sheetIndex = book.sheetCount
+		book.sheetCount += 1
+		sheets = self.calc.Sheets
+		if sheets.hasByName(self.name):
+			self.sheet = sheets.getByName(self.name)
+			if self.sheet.RangeAddress.Sheet != self.sheetIndex:
+				sheets.moveByName(self.name, self.sheetIndex)
+				self.sheet = sheets.getByName(self.name)
+			self.readKey()
+			return
+		sheets.insertNewByName(self.name, self.sheetIndex)
+		self.sheet = sheets.getByName(self.name)
+		self.sheet.PageStyle = copyPageStyle(self.calc, f'PS Report {self.name}')
+
+	def open(self, path):
+		"""Open the document of an earlier run to update it
+
+		A document whose first sheet has another name was made for
+		other lists, and is replaced.
+		"""
+		self.load(uno.systemPathToFileUrl(os.path.abspath(path)), [])
+		self.readKey()
+		if self.sheet.Name != self.name:
+			self.replace()
 
-	def getCell(self, x, y):
-		return self.sheet.getCellByPosition(x, y)
+	def keepSheets(self, names):
+		"""Remove the sheets of the document that are not in names
+
+		A workbook opened for update may have sheets for lists that are
+		empty now, which must not be printed again.
+		"""
+		sheets = self.calc.Sheets
+		for name in sheets.ElementNames:
+			if name not in names:
+				sheets.removeByName(name)
+
+	def readKey(self):
+		"""Get the dataKey of the sheet as stored in the document"""
+		props = self.calc.DocumentProperties.UserDefinedProperties
+		self.stored = ''
+		self.keyStored = props.PropertySetInfo.hasPropertyByName(self.layoutProperty)
+		if self.keyStored:
+			self.stored = props.getPropertyValue(self.layoutProperty)
+
+	def storeKey(self, key):
+		props = self.calc.DocumentProperties.UserDefinedProperties
+		if self.keyStored:
+			props.setPropertyValue(self.layoutProperty, key)
+		else:
+			props.addProperty(self.layoutProperty, 0, key)
+
+	def replace(self):
+		"""Give up the document opened for update for a new one
+
+		A sheet added to a workbook only replaces itself.
+		"""
+		self.stored = None
+		if self.layoutProperty != LayoutProperty:
+			sheets = self.calc.Sheets
+			sheets.removeByName(self.name)
+			sheets.insertNewByName(self.name, self.sheetIndex)
+			self.sheet = sheets.getByName(self.name)
+			self.sheet.PageStyle = copyPageStyle(self.calc, f'PS Report {self.name}')
+			return
+		self.calc.close(True)
+		if batchMode:
+			documents.remove(self.calc)
+		self.keyStored = False
+		self.create()
+
+	def dataKey(self, lists, style):
+		"""Everything the placement and formatting of lists depends on"""
+		return repr((
+			tuple(len(ll) for ll in lists), tuple(len(ll[0]) for ll in lists if ll),
+			self.cols, self.titlerows, style
+		))
 
-	def getMergeCell(self, x, y):
-		r = self.sheet.getCellRangeByPosition(x, y, x, y + 1)
-		r.merge(True)
+	def addData(self, *lists, style='Block'):
+		"""Put lists on the sheet, see layout.BaseSheet
+
+		In a document opened for update, only the changed values are
+		written, as long as the lists have the lengths of those it was
+		made from. Otherwise it is replaced by a new document.
+		"""
+		key = self.dataKey(lists, style)
+		if self.stored == key:
+			self.refresh(lists, style)
+			return
+		if self.stored is not None:
+			self.replace()
+		super().addData(*lists, style=style)
+		self.storeKey(key)
+
+	def refresh(self, lists, style):
+		"""Write the values of lists that differ from those in the sheet
+
+		Layout, formatting and page scale of the document stay, the
+		formatting methods only update what depends on the values.
+		"""
+		self.planLists(lists, style)
+		self.refreshed = True
+		# The cells written, by position
+		self.changed = []
+		# What the cells of the labels hold afterwards, see setListLabels
+		self.labelCells = {}
+		y0 = self.titlerows
+		# The labels of several lists are not in the grids, and stay as
+		# they are. The label of a single list is on its first row,
+		# which is written here, and setListLabels puts it back.
+		headers = {(p.x + 1, p.y) for p in self.HeaderPositions}
+		labels = headers if len(self.HeaderPositions) > 1 else set()
+		for t, grid in enumerate(self.grids):
+			x0 = t * (self.colCols + 1)
+			cells = self.sheet.getCellRangeByPosition(
+				x0, y0, x0 + self.colCols - 1, y0 + self.totalRows - 1
+			)
+			stored = cells.getDataArray()
+			grid = [
+				tuple(
+					old[i] if (x0 + i, y0 + r) in labels else line[i]
+					for i in range(self.colCols)
+				)
+				for r, (old, line) in enumerate(zip(stored, grid))
+			]
+			changed = [
+				(i, r) for r, (old, line) in enumerate(zip(stored, grid))
+				for i in range(self.colCols) if old[i] != line[i]
+			]
+			if len(changed) > RefreshLimit:
+				cells.setDataArray(tuple(grid))
+			else:
+				for i, r in changed:
+					cell = cells.getCellByPosition(i, r)
+					if isinstance(grid[r][i], float):
+						cell.Value = grid[r][i]
+					else:
+						cell.String = grid[r][i]
+			self.changed += ((x0 + i, y0 + r) for i, r in changed)
+			for x, y in headers:
+				if 0 <= x - x0 < self.colCols:
+					self.labelCells[x, y] = grid[y - y0][x - x0]
+
+	def restyleUnits(self):
+		"""Set the unit style of the changed cells of greyUnit columns"""
+		units, others = [], []
+		for x, y in self.changed:
+			t, i = divmod(x, self.colCols + 1)
+			if i < len(self.ColDefs) and self.ColDefs[i].greyUnit:
+				val = self.grids[t][y - self.titlerows][i]
+				(units if layout.isPieceUnit(val) else others).append(
+					self.rangeAddress(x, y, x, y)
+				)
+		if units:
+			self.cellRanges(units).CellStyle = 'PS Unit'
+		if others:
+			self.cellRanges(others).CellStyle = 'Default'
+
+	def getCell(self, x, y):
 		return self.sheet.getCellByPosition(x, y)
 
 	def getCol(self, col):
@@ -101,10 +455,28 @@ class Sheet:
 	def getRow(self, row):
 		return self.sheet.getRows().getByIndex(row)
 
-	def styleBlock(self, x, y, n):
-		"""Style a row, Blocks with lines everywhere.
+	def rangeAddress(self, x0, y0, x1, y1):
+		return CellRangeAddress(
+			Sheet=self.sheetIndex,
+			StartColumn=x0, StartRow=y0, EndColumn=x1, EndRow=y1
+		)
+
+	def cellRanges(self, addresses):
+		"""A single SheetCellRanges object for all addresses
+
+		Setting a property on it changes all ranges at once.
 		"""
-		cells = self.sheet.getCellRangeByPosition(x, y, x + n - 1, y)
+		ranges = self.calc.createInstance("com.sun.star.sheet.SheetCellRanges")
+		ranges.addRangeAddresses(tuple(addresses), False)
+		return ranges
+
+	def styleBlock(self, x, y, n, rows=1):
+		"""Style rows, Blocks with lines everywhere.
+
+		Borders set on a range apply to each of its cells, so all
+		rows of a block are styled at once.
+		"""
+		cells = self.sheet.getCellRangeByPosition(x, y, x + n - 1, y + rows - 1)
 		cells.LeftBorder = self.Linestyle
 		cells.RightBorder = self.Linestyle
 		cells.TopBorder = self.Linestyle
@@ -112,241 +484,169 @@ class Sheet:
 		cells.ParaRightMargin = 100
 		cells.ParaLeftMargin = 100
 
-	def styleAltGrey(self, x, y, n):
-		"""Style a row, Alternating grey background
+	def styleAltGrey(self, x, y, n, rows=1):
+		"""Style rows, Alternating grey background
+		"""
+		y1 = y + rows - 1
+		x1 = x + n - 1
+		self.sheet.getCellRangeByPosition(x, y, x, y1).LeftBorder = self.Linestyle
+		self.sheet.getCellRangeByPosition(x1, y, x1, y1).RightBorder = \
+			self.Linestyle
+		odd = [
+			self.rangeAddress(x, r, x + n - 1, r)
+			for r in range(y | 1, y1 + 1, 2)
+		]
+		if odd:
+			self.cellRanges(odd).CellBackColor = 0xdddddd
+
+	def writeGrids(self, grids, currencyCols):
+		"""Write the grids of addData, one range per column of lists
 		"""
-		self.getCell(x, y).LeftBorder = self.Linestyle
-		self.getCell(x + n - 1, y).RightBorder = self.Linestyle
-		if (y & 1) == 1:
+		y0 = self.titlerows
+		y1 = self.titlerows + self.totalRows - 1
+		for t, grid in enumerate(grids):
+			x0 = t * (self.colCols + 1)
 			cells = self.sheet.getCellRangeByPosition(
-				x, y, x + n - 1, y
+				x0, y0, x0 + self.colCols - 1, y1
 			)
-			cells.CellBackColor = 0xdddddd
+			cells.setDataArray(tuple(tuple(line) for line in grid))
+		for t, i in sorted(currencyCols):
+			x = t * (self.colCols + 1) + i
+			self.sheet.getCellRangeByPosition(x, y0, x, y1).CellStyle = 'PS Price'
 
-	def addData(self, *lists, style='Block'):
-		mysheet = self
-
-		class Cellpos:
-			def __init__(self, cols, rows):
-				self.x = 0
-				self.y = mysheet.titlerows
-				self.cols = cols
-				self.rows = rows
-
-			def advance(self):
-				# go one down
-				self.y += 1
-				# if at bottom row, go to top and left
-				if self.y == self.rows + mysheet.titlerows:
-					self.x = self.x + self.cols + 1
-					self.y = mysheet.titlerows
-
-		# N is sum of list members
-		N = 0
-		for list in lists: N += len(list)
-		# colCols is the number of columns in each list. All lists
-		# are supposed to have the same number of columns.
-		self.colCols = max(len(ll[0]) if len(ll) > 0 else 0 for ll in lists)
-		if self.colCols == 0:
-			raise ValueError('All lists are empty')
-		self.HeaderPositions = []
-		self.totalCols = self.cols * (self.colCols + 1) - 1
-		# Each list starts with a Label, using a single row
-		# then one row for each member and another row to separate
-		# the list from the next one. The total numer of rows
-		# is TR = <number of lists> * 2 - 1 + <sum of list lengths>
-		needed = len(lists) * 2 - 1 + N
-		# We want to divide these equally over all columns,
-		# so we round up to the next multiple of cols and
-		# get the actual number of sheet rows
-		self.totalRows = (needed + self.cols-1) // self.cols
-		rest = self.totalRows * self.cols - needed
-
-		pos = Cellpos(self.colCols, self.totalRows)
-		styler = getattr(self, 'style'+style)
-		for list in lists:
-			self.HeaderPositions.append(Pos(pos.x, pos.y))
-			# advance once, to get room for the label
-			if len(lists) > 1:
-				pos.advance()
-			for row in list:
-				for i, val in enumerate(row):
-					cell = self.getCell(pos.x + i, pos.y)
-					if isinstance(val, numbers.Number) and val < 2000000000:
-						cell.Value = val
-					else:
-						cell.String = val
-					if isinstance(val, float):
-						cell.NumberFormat = self.currencyformat
-				styler(pos.x, pos.y, self.colCols)
-				pos.advance()
-			# advance once at the end of a list
-			pos.advance()
-			if rest > 0:
-				pos.advance()
-				rest -= 1
-
-	def addPagelistrow(self, row):
-		cell = self.getMergeCell(0, self.crow)
-		cell.String = row[0]
-		cell = self.getMergeCell(1, self.crow)
-		cell.String = row[1]
-		cell = self.getCell(2, self.crow)
-		cell.String = row[2]
-		cell = self.getCell(2, self.crow+1)
-		cell.String = row[3]
-		cell = self.getMergeCell(3, self.crow)
-		cell.Value = row[4]
-		cell.NumberFormat = self.currencyformat
-		cell = self.getMergeCell(4, self.crow)
-		cell.Value = row[5]
-		cell.NumberFormat = self.currencyformat
-		self.crow += 2
-
-	def addPagelist(self, *lists, style='Block', hstretch=1.2):
-		"""Add a single page list in fixed layout
+	def streamPagelist(self, pages, style='Block'):
+		"""Add a page list in fixed layout, see layout.BaseSheet
 
 		Solely used by Wagenlisten, which produces several pages,
-		one for each location.
+		one for each location. Page lists are never refreshed, a
+		document opened for update is replaced.
 		"""
-		self.crow = self.titlerows
-		self.colCols = len(lists[0][0])
-		self.HeaderPositions = []
-		self.totalCols = self.colCols
-		styler = getattr(self, 'style'+style)
-		for list in lists:
-			if self.crow > self.titlerows:
-				self.getRow(self.crow).IsStartOfNewPage = True
-			for row in list:
-				self.addPagelistrow(row)
-				styler(0, self.crow-2, self.colCols-1)
-				styler(0, self.crow-1, self.colCols-1)
-
-	def getOptimalScale(self, header=False):
-		"""Calculate the optimal scale factor in percent
+		if self.stored is not None:
+			self.replace()
+		super().streamPagelist(pages, style)
+
+	def writePage(self, y, rows, newPage):
+		"""Write a page of a page list, from sheet row y on
+
+		The cells of the first row are merged and styled, then copied
+		down, twice as many rows each time, so a page takes a few calls
+		for the merges and one setDataArray for the values, however
+		many rows it has.
 		"""
-		w = 0
-		for i in range(self.totalCols):
-			w += self.getCol(i).Width
-		h = 0
-		for i in range(self.totalRows):
-			h += self.getRow(i).Height
-		if h == 0 or w == 0: return 100  # should not happen
-		ws = 19500 / w  # factor to scale to 195mm width
-		hs = 28200 / h  # factor to scale to 270mm height
-		# We must use the smaller of the two for scaling.
-		# If hs is smaller, the resulting height is at the maximum,
-		# and we only might make the Columns a bit wider, but we don't
-		if hs < ws: return int(hs * 100)
-		# If ws is smaller, the resulting width is at the maximum.
-		# In that case we can still make each row a bit higher to increase
-		# readability
-		hstretch = 28200 / (h * ws)
-		if hstretch > 1.5: hstretch = 1.5
-		for i in range(self.totalRows):
-			self.getRow(i).Height = self.getRow(i).Height * hstretch
-		return int(ws * 100)
-
-	def getOptimalScaleExt(self, landscape, pages, header=False):
-		nrows = (self.totalRows + pages-1) // pages
-		w = 0
-		for i in range(self.totalCols):
-			w += self.getCol(i).Width
-		h = 0
-		for i in range(nrows):
-			h += self.getRow(i+self.titlerows).Height
-		for i in range(self.titlerows):
-			h += self.getRow(i).Height
-		if h == 0 or w == 0: return 100  # should not happen
-		if landscape:
-			towidth = 28400
-			toheight = 19800
-		else:
-			towidth = 19800
-			toheight = 28400
-		if header:
-			toheight -= 900
-		ws = towidth / w
-		hs = toheight / h
-		if hs < ws: return int(hs * 100)
-		hstretch = toheight / (h * ws)
-		if hstretch > 1.8: hstretch = 1.8
-		for i in range(self.titlerows, self.totalRows):
-			self.getRow(i).Height = self.getRow(i).Height * hstretch
-		return int(ws * 100)
-
-	def pieceMarker(self, x, y):
-		cell = self.getCell(x, y)
-		if len(cell.String) == 2 and cell.String != 'Kg':
-			# cell.CellBackColor = 0xdddddd
-			cell.CharWeight = self.Boldface
+		n = 2 * len(rows)
+		if newPage:
+			self.getRow(y).IsStartOfNewPage = True
+		for x in layout.PageMerged:
+			self.sheet.getCellRangeByPosition(x, y, x, y + 1).merge(True)
+		self.sheet.getCellRangeByPosition(3, y, 4, y + 1).CellStyle = 'PS Price'
+		done = 2
+		while done < n:
+			k = min(done, n - done)
+			self.sheet.copyRange(
+				CellAddress(Sheet=self.sheetIndex, Column=0, Row=y + done),
+				CellRangeAddress(
+					Sheet=self.sheetIndex, StartColumn=0, StartRow=y,
+					EndColumn=4, EndRow=y + k - 1
+				)
+			)
+			done += k
+		self.sheet.getCellRangeByPosition(0, y, 4, y + n - 1).setDataArray(
+			tuple(layout.pageGrid(rows))
+		)
+
+	def measureWidth(self, x):
+		return self.getCol(x).Width
 
-	def pieceMarkCol(self, col):
-		for i in range(self.totalRows):
-			self.pieceMarker(col, i)
+	def measureRow(self, y):
+		return self.getRow(y).Height
+
+	def stretchRows(self, runs, hstretch):
+		for y, n, height in runs:
+			self.sheet.getCellRangeByPosition(0, y, 0, y + n - 1).Rows.Height = \
+				int(height * hstretch)
 
 	def formatCol(self, i, cdef):
 		col = self.getCol(i)
 		if cdef.tryOptWidth:
-			col.OptimalWidth = True
-			if col.Width > cdef.width * 100:
-				col.Width = cdef.width * 100
+			width = self.optimalWidth(i, cdef)
+			if width is None:
+				col.OptimalWidth = True
+				width = col.Width
+			col.Width = self.colWidths[i] = min(width, cdef.width * 100)
 		else:
-			col.Width = cdef.width * 100
-		if cdef.bold:
-			col.CharWeight = self.Boldface
-		if cdef.greyUnit:
-			self.pieceMarkCol(i)
+			col.Width = self.colWidths[i] = cdef.width * 100
 		if cdef.height != 12:
 			col.CharHeight = cdef.height
 		if cdef.hright:
-			col.HoriJustify = horRight
+			col.HoriJustify = unores.horiJustify('RIGHT')
 		if cdef.hleft:
-			col.HoriJustify = horLeft
-		col.VertJustify = vertCenter
+			col.HoriJustify = unores.horiJustify('LEFT')
+		col.VertJustify = unores.vertJustify('CENTER')
 
 	def formatColumns(self):
+		if self.refreshed:
+			self.restyleUnits()
+			return
+		bold = []
+		units = []
+		for i, cdef in enumerate(self.ColDefs):
+			if cdef.greyUnit:
+				units += (self.rangeAddress(*p, *p) for p in self.unitCells.get(i, ()))
 		for t in range(self.cols):
 			for i, cdef in enumerate(self.ColDefs):
-				self.formatCol(t * (self.colCols + 1) + i, cdef)
+				x = t * (self.colCols + 1) + i
+				self.formatCol(x, cdef)
+				if cdef.bold:
+					bold.append(self.rangeAddress(
+						x, self.titlerows, x, self.titlerows + self.totalRows - 1
+					))
 			if t < self.cols-1:
-				self.getCol((t+1) * (self.colCols + 1) - 1).Width = 800
+				x = (t+1) * (self.colCols + 1) - 1
+				self.getCol(x).Width = self.colWidths[x] = 800
+		if bold:
+			self.cellRanges(bold).CellStyle = 'PS Bold'
+		if units:
+			self.cellRanges(units).CellStyle = 'PS Unit'
 
 	def setListLabels(self, *labels, cheight=14):
+		"""Put the labels of the lists above them
+
+		A refreshed document has the formatting already, only labels
+		that refresh overwrote or that changed are written.
+		"""
+		self.labelHeight = cheight
 		for i, l in enumerate(labels):
 			p = self.HeaderPositions[i]
+			if self.refreshed:
+				if self.labelCells.get((p.x + 1, p.y)) != l:
+					self.getCell(p.x + 1, p.y).String = l
+				continue
 			cell = self.getCell(p.x + 1, p.y)
 			cell.String = l
 			cell.CharHeight = cheight
 			cell.CharWeight = self.Boldface
 
 	def setPageStyle(self, landscape=False, maxscale=True, pages=1, date=False):
-		defp = self.calc.StyleFamilies.PageStyles.getByName("Default")
-		defp.LeftMargin = 500
-		defp.TopMargin = 500
-		defp.BottomMargin = 500
-		defp.RightMargin = 500
-		defp.HeaderIsOn = False
-		defp.FooterIsOn = False
-		defp.CenterHorizontally = True
-		defp.CenterVertically = False
-		if landscape:
-			defp.Width = 29700
-			defp.Height = 21000
-			defp.IsLandscape = True
+		# Margins and the like come with the page style, see defineStyles
+		defp = self.calc.StyleFamilies.PageStyles.getByName(self.sheet.PageStyle)
 		if date:
 			defp.HeaderIsOn = True
 			hs = defp.RightPageHeaderContent
 			hs.LeftText.String = datetime.date.today().strftime('%d.%m.%Y')
 			hs.CenterText.String = ''
 			defp.RightPageHeaderContent = hs
+		# A refreshed document keeps its page layout
+		if self.refreshed: return
+		if landscape:
+			defp.Width = 29700
+			defp.Height = 21000
+			defp.IsLandscape = True
 		if maxscale:
-			if landscape or pages > 1:
-				defp.PageScale = self.getOptimalScaleExt(landscape, pages, header=date)
-			else:
-				defp.PageScale = self.getOptimalScale(header=date)
+			defp.PageScale = self.pageScale(landscape, pages, header=date)
 
 	def setHeaderRow(self, titles):
+		self.titles = tuple((t[1], t[2].height) for t in titles)
+		if self.refreshed: return
 		self.sheet.setTitleRows(CellRangeAddress(StartRow=0, EndRow=0))
 		for i in range(self.cols):
 			for title in titles:
@@ -359,7 +659,21 @@ class Sheet:
 				if cdef.height != 12:
 					cell.CharHeight = cdef.height
 				if cdef.hcenter:
-					cell.HoriJustify = horCenter
+					cell.HoriJustify = unores.horiJustify('CENTER')
+
+
+# The sheets the reports create, see useDirect
+UnoSheet = Sheet
+
+
+def useDirect(enabled=True):
+	"""Write .ods files without LibreOffice, see odsheet
+
+	The documents are then collected in odsheet.documents.
+	"""
+	global Sheet
+	import odsheet
+	Sheet = odsheet.OdsSheet if enabled else UnoSheet
 
 
 class WaagenlistenQuery(Query):
@@ -371,6 +685,7 @@ class WaagenlistenQuery(Query):
 	]
 
 
+@viaWorker
 def Waagenlisten(*args):
 	"""
 	Location based lists
@@ -388,17 +703,13 @@ def Waagenlisten(*args):
 		'Pilze', 'Zitrone', 'Zwiebel'
 	]
 
-	lists = []
-
-	for loc in locs:
-		# Obtain list for location
-		L = WaagenlistenQuery(iwg=loc).run()
-		# Use consistent capitalization for the unit
-		for r in L: r[3] = r[3].capitalize()
-		lists.append(L)
+	# Obtain the lists of all locations with a single query, and
+	# write them page by page as they come
+	pages = WaagenlistenQuery.streamBatch('iwg', locs)
 
 	sheet = Sheet('Waagenliste', 1, titlerows=1)
-	sheet.addPagelist(*lists)
+	# Use consistent capitalization for the unit
+	sheet.streamPagelist((loc, unitCapitalized(rows)) for loc, rows in pages)
 
 	sheet.addColumns([
 		ColumnDef(height=24, width=18, bold=True, hleft=True),
@@ -422,6 +733,7 @@ class WaageQuery(Query):
 	CONDS = ["Waage = 'A'"]
 
 
+@viaWorker
 def Waagenliste(*args):
 	"""Lists for the electronic balances
 
@@ -431,15 +743,16 @@ def Waagenliste(*args):
 
 	The list is in landscape format and fitted to two pages.
 	"""
-	# Obtain lists from DB via sql query
-	listGemuese = WaageQuery(wg='0001').run()
-	listObst = WaageQuery(wg='0003').run()
+	# Obtain lists from DB via sql query, while the document opens
+	pending = WaageQuery.submitBatch(dict(wg='0001'), dict(wg='0003'))
+
+	sheet = Sheet('Waagenliste', 2, titlerows=1)
+	listGemuese, listObst = pending.result()
 
 	# Use a consistant capitalization for the unit
-	for r in listGemuese: r[5] = r[5].capitalize()
-	for r in listObst:    r[5] = r[5].capitalize()
+	listGemuese = unitCapitalized(listGemuese)
+	listObst = unitCapitalized(listObst)
 
-	sheet = Sheet('Waagenliste', 2, titlerows=1)
 	sheet.addData(listGemuese, listObst, style='AltGrey')
 	sheet.addColumns([
 		ColumnDef(height=13, width=10, bold=True, hleft=True),
@@ -467,6 +780,7 @@ class WaagenupQuery(Query):
 	CONDS = ["Waage = 'A'"]
 
 
+@viaWorker
 def WaagenlisteUp(*args):
 	"""Lists for the electronic balances
 
@@ -476,15 +790,16 @@ def WaagenlisteUp(*args):
 
 	The list is in portrait format and fitted onto a single page.
 	"""
-	# Obtain lists from DB via sql query
-	listGemuese = WaagenupQuery(wg='0001').run()
-	listObst = WaagenupQuery(wg='0003').run()
+	# Obtain lists from DB via sql query, while the document opens
+	pending = WaagenupQuery.submitBatch(dict(wg='0001'), dict(wg='0003'))
+
+	sheet = Sheet('Waagenliste', 2)
+	listGemuese, listObst = pending.result()
 
 	# Use a consistant capitalization for the unit
-	for r in listGemuese: r[3] = r[3].capitalize()
-	for r in listObst:    r[3] = r[3].capitalize()
+	listGemuese = unitCapitalized(listGemuese)
+	listObst = unitCapitalized(listObst)
 
-	sheet = Sheet('Waagenliste', 2)
 	sheet.addData(listGemuese, listObst)
 	sheet.addColumns([
 		ColumnDef(width=10, bold=True),
@@ -506,9 +821,14 @@ class SchrankQuery(Query):
 
 def _schrankliste(title, iwg, **pageopts):
 	"""Lists for the Refridgerators"""
-	data = SchrankQuery(iwg=iwg).run()
+	pending = SchrankQuery(iwg=iwg).submit()
 
 	sheet = Sheet(title, 1, titlerows=1)
+	_schranksheet(sheet, pending.result(), **pageopts)
+
+
+def _schranksheet(sheet, data, **pageopts):
+	"""Fill the sheet of a refridgerator with its articles data"""
 	sheet.addData(data)
 	sheet.setHeaderRow([
 		[0, 'EAN', ColumnDef(bold=True, hcenter=True)],
@@ -532,6 +852,44 @@ def _schrankliste(title, iwg, **pageopts):
 	return None
 
 
+# Title, location and page options of each refridgerator
+Fridges = [
+	("Kühlschrank links", "kühl links", {}),
+	("Kühlschrank rechts", "kühl rechts", {}),
+	("Kühlschrank Molkereiprodukte 1", "1Mopro", {}),
+	("Kühlschrank Molkereiprodukte 2", "2Mopro", {}),
+	("Kühlschrank Mix", "3Mix", {}),
+	("Kühlschrank Vegan", "4Vegan", {}),
+	("Kühlschrank Fleisch", "5Fleisch", dict(pages=2)),
+]
+
+
+@viaWorker
+def KuehlschrankAlle(*args):
+	"""Lists for all refridgerators in a single document
+
+	One query for all of them, and one sheet for each, with the
+	page style of its own scale. The document is printed or exported
+	as a whole. A refridgerator without articles gets no sheet.
+	"""
+	pending = SchrankQuery.submitBatch(
+		*(dict(iwg=iwg) for title, iwg, opts in Fridges)
+	)
+	results = list(zip(pending.result(), Fridges))
+	# If all are empty, the first one tells so, as its own list would
+	filled = [(data, fridge) for data, fridge in results if data] or results[:1]
+	names = [title for data, (title, iwg, pageopts) in filled]
+
+	book = None
+	for data, (title, iwg, pageopts) in filled:
+		sheet = Sheet(title, 1, titlerows=1, book=book)
+		if book is None:
+			book = sheet
+			# An updated workbook may have sheets of empty fridges
+			book.keepSheets(names)
+		_schranksheet(sheet, data, **pageopts)
+
+
 def KuehlschrankLinks(*args):
 	_schrankliste("Kühlschrank links", "kühl links")
 
@@ -540,22 +898,27 @@ def KuehlschrankRechts(*args):
 	_schrankliste("Kühlschrank rechts", "kühl rechts")
 
 
+@viaWorker
 def KuehlschrankMopro1(*args):
 	_schrankliste("Kühlschrank Molkereiprodukte 1", "1Mopro")
 
 
+@viaWorker
 def KuehlschrankMopro2(*args):
 	_schrankliste("Kühlschrank Molkereiprodukte 2", "2Mopro")
 
 
+@viaWorker
 def KuehlschrankMix(*args):
 	_schrankliste("Kühlschrank Mix", "3Mix")
 
 
+@viaWorker
 def KuehlschrankVegan(*args):
 	_schrankliste("Kühlschrank Vegan", "4Vegan")
 
 
+@viaWorker
 def KuehlschrankFleisch(*args):
 	_schrankliste("Kühlschrank Fleisch", "5Fleisch", pages=2)
 
@@ -566,16 +929,18 @@ class KassenlandQuery(Query):
 	CONDS = ["Waage = 'A'"]
 
 
+@viaWorker
 def KassenlisteGemuese(*args):
-	# Obtain lists from DB via sql query
-	listGemuese = KassenlandQuery(wg='0001').run()
-	listObst = KassenlandQuery(wg='0003').run()
+	# Obtain lists from DB via sql query, while the document opens
+	pending = KassenlandQuery.submitBatch(dict(wg='0001'), dict(wg='0003'))
+
+	sheet = Sheet('Kassenliste', 2)
+	listGemuese, listObst = pending.result()
 
 	# Use a consistant capitalization for the unit
-	for r in listGemuese: r[3] = r[3].capitalize()
-	for r in listObst:    r[3] = r[3].capitalize()
+	listGemuese = unitCapitalized(listGemuese)
+	listObst = unitCapitalized(listObst)
 
-	sheet = Sheet('Kassenliste', 2)
 	sheet.addData(listGemuese, listObst)
 	sheet.addColumns([
 		ColumnDef(width=10, bold=True),         # EAN
@@ -597,15 +962,18 @@ class KassenQuery(Query):
 
 
 def KassenlisteBrot(name, id):
-	# Obtain lists from DB via sql query
-	lst1 = KassenQuery(wg='0020', liefer=id).run()
-	lst2 = KassenQuery(wg='0025', liefer=id).run()
+	# Obtain lists from DB via sql query, while the document opens
+	pending = KassenQuery.submitBatch(
+		dict(wg='0020', liefer=id), dict(wg='0025', liefer=id)
+	)
+
+	sheet = Sheet('KassenlisteBrot'+id, 2)
+	lst1, lst2 = pending.result()
 
 	# Use a consistant capitalization for the unit
-	for r in lst1: r[2] = r[2].capitalize()
-	for r in lst2: r[2] = r[2].capitalize()
+	lst1 = unitCapitalized(lst1)
+	lst2 = unitCapitalized(lst2)
 
-	sheet = Sheet('KassenlisteBrot'+id, 2)
 	sheet.addData(lst1, lst2)
 	sheet.addColumns([
 		ColumnDef(width=15, bold=True),         # EAN
@@ -620,19 +988,22 @@ def KassenlisteBrot(name, id):
 	return None
 
 
+@viaWorker
 def KassenlisteBrotS(*args):
 	return KassenlisteBrot('Schäfer', 'SCHÄFERBROT')
 
 
+@viaWorker
 def KassenlisteBrotW(*args):
 	return KassenlisteBrot('Weber', 'WEBER')
 
 
 def KassenlisteFleisch(name, id):
-	lst = KassenQuery(wg='0090', liefer=id).run()
-	for r in lst: r[2] = r[2].capitalize()
+	pending = KassenQuery(wg='0090', liefer=id).submit()
 
 	sheet = Sheet('KassenlisteFleisch'+name, 2)
+	lst = unitCapitalized(pending.result())
+
 	sheet.addData(lst)
 	sheet.addColumns([
 		ColumnDef(width=15, bold=True),         # EAN
@@ -647,32 +1018,40 @@ def KassenlisteFleisch(name, id):
 	return None
 
 
+@viaWorker
 def KassenlisteFleischFau(*args):
 	return KassenlisteFleisch('Fauser', 'FAUSER')
 
 
+@viaWorker
 def KassenlisteFleischUnt(*args):
 	return KassenlisteFleisch('Unterweger', 'UNTERWEGER')
 
 
+@viaWorker
 def KassenlisteFleischUri(*args):
 	return KassenlisteFleisch('Uria', 'URIA')
 
 
+@viaWorker
 def KassenlisteLoseWare(*args):
-	lst1 = KassenQuery(wg='0585').run()
-	lst2 = KassenQuery(wg='0590').run()
-	lst3 = KassenQuery(iwg='HH', wg='0400').run()
-	lst4 = KassenQuery(iwg='HH', wg=['0070', '0200', '0280', '0340']).run()
-	lst5 = KassenQuery(iwg='HH', wg=['0020', '0025', '0060']).run()
-
-	for r in lst1: r[2] = r[2].capitalize()
-	for r in lst2: r[2] = r[2].capitalize()
-	for r in lst3: r[2] = r[2].capitalize()
-	for r in lst4: r[2] = r[2].capitalize()
-	for r in lst5: r[2] = r[2].capitalize()
+	pending = KassenQuery.submitBatch(
+		dict(wg='0585'),
+		dict(wg='0590'),
+		dict(iwg='HH', wg='0400'),
+		dict(iwg='HH', wg=['0070', '0200', '0280', '0340']),
+		dict(iwg='HH', wg=['0020', '0025', '0060'])
+	)
 
 	sheet = Sheet('KassenlisteLoseWare', 2)
+	lst1, lst2, lst3, lst4, lst5 = pending.result()
+
+	lst1 = unitCapitalized(lst1)
+	lst2 = unitCapitalized(lst2)
+	lst3 = unitCapitalized(lst3)
+	lst4 = unitCapitalized(lst4)
+	lst5 = unitCapitalized(lst5)
+
 	sheet.addData(lst1, lst2, lst3, lst4, lst5)
 	sheet.addColumns([
 		ColumnDef(width=32, bold=True),         # EAN
@@ -690,8 +1069,15 @@ def KassenlisteLoseWare(*args):
 	return None
 
 
+try:
+	mkcctx(XSCRIPTCONTEXT.getComponentContext())
+except NameError:
+	# Plain python without LibreOffice, queries need bodb.useMirror
+	useDirect()
+else:
+	# Reuse query results of earlier runs unless the prices have changed
+	useCache(ttl=12 * 3600, validate=True)
 # Only export the public functions as macros
-mkcctx(XSCRIPTCONTEXT.getComponentContext())
 g_exportedScripts = [
 	KassenlisteBrotS,
 	KassenlisteBrotW,
@@ -700,6 +1086,7 @@ g_exportedScripts = [
 	KassenlisteFleischUri,
 	KassenlisteGemuese,
 	KassenlisteLoseWare,
+	KuehlschrankAlle,
 	KuehlschrankMopro1,
 	KuehlschrankMopro2,
 	KuehlschrankMix,
@@ -709,3 +1096,15 @@ g_exportedScripts = [
 	WaagenlisteUp,
 	Waagenlisten
 ]
+if os.environ.get('PS_PROFILE'):
+	do_profile(os.environ['PS_PROFILE'])
+
+# The first click on a macro pays for the import, and so does every
+# click after this file changed
+importTime = time.perf_counter() - _importStarted
+if importTime > ImportBudget:
+	import logging
+	logging.getLogger('libreoffice').warning(
+		'Importing Psmacros took %.3fs, more than the budget of %.3fs',
+		importTime, ImportBudget
+	)
@@ -1,31 +1,104 @@
+import array
+import collections
+import hashlib
+import itertools
+import os
+import pickle
+import threading
+import time
 import types
+import unicodedata
+
+CC = None
 
 
 def mkcctx(cc):
 	global CC
+	if CC is not None and cc != CC:
+		# Connections belong to the old context
+		pool.clear()
 	CC = cc
 
 
 class BioOfficeConn:
 	"""Connection to our Bio-Office database"""
 
-	def __init__(self):
+	def __init__(self, source='bodb'):
 		# Obtain connection to our database.
 		# Needs the registered data source "bodb"
+		self.source = source
 		self.dbconn = CC.ServiceManager.createInstanceWithContext(
 			"com.sun.star.sdb.DatabaseContext", CC
-		).getByName("bodb").getConnection('', '')
+		).getByName(source).getConnection('', '')
+		self.lastUsed = time.monotonic()
+		# Prepared statements, by their SQL
+		self.statements = {}
 
-	def queryResult(self, sql, types):
-		"""Get the results of an SQL query as a list
+	def isAlive(self, maxidle=60):
+		"""Check if the connection can still be used
 
-		sql is the query as a string, types is a string specifying
-		the types in each row. I is for Int, S for String, D for Double.
+		A connection that has been idle for more than maxidle seconds
+		is probed with a trivial query, as the server (or the network
+		in between) may have dropped it without us noticing.
 		"""
-		meths = []
-		result = []
-		dbres = self.dbconn.createStatement().executeQuery(sql)
+		try:
+			if self.dbconn.isClosed(): return False
+			if time.monotonic() - self.lastUsed > maxidle:
+				self.dbconn.createStatement().executeQuery('SELECT 1')
+				self.lastUsed = time.monotonic()
+		except Exception:
+			return False
+		return True
+
+	def close(self):
+		try:
+			self.dbconn.close()
+		except Exception:
+			pass
+
+	# Rows fetched per round trip to the server
+	FetchSize = 500
+
+	def prepared(self, sql):
+		"""Get a prepared statement for sql
+
+		Statements are prepared once and then reused for as long as
+		the connection lives, so the server has to compile each query
+		only once.
+		"""
+		stmt = self.statements.get(sql)
+		if stmt is None:
+			stmt = self.statements[sql] = self.dbconn.prepareStatement(sql)
+			try:
+				stmt.FetchSize = self.FetchSize
+			except Exception:
+				pass  # the driver decides itself
+		return stmt
+
+	def fetch(self, sql, types, params=(), packed=False):
+		"""Generate the rows of an SQL query as tuples
+
+		If packed is True, the query must deliver all fields of a row
+		in its first column, separated by PackSep (see packcols). The
+		row then costs a single getString call over the bridge
+		instead of one call per field.
+		"""
+		stmt = self.prepared(sql)
+		for i, p in enumerate(params):
+			stmt.setString(i+1, p)
+		dbres = stmt.executeQuery()
+		self.lastUsed = time.monotonic()
+
+		if packed:
+			convs = [_convs[c] for c in types]
+			while dbres.next():
+				yield tuple(
+					conv(v) for conv, v in
+					zip(convs, dbres.getString(1).split(PackSep))
+				)
+			return
 
+		meths = []
 		# create a list of methods from the type string
 		for c in types:
 			if c == 'I':
@@ -36,17 +109,455 @@ class BioOfficeConn:
 				meths.append(getattr(dbres, 'getDouble'))
 
 		while dbres.next():
-			result.append([meths[i](i+1) for i in range(len(meths))])
+			yield tuple(meths[i](i+1) for i in range(len(meths)))
+
+	def queryResult(self, sql, types, params=(), packed=False, record=tuple):
+		"""Get the results of an SQL query as a list
+
+		sql is the query as a string, types is a string specifying
+		the types in each row. I is for Int, S for String, D for Double.
+		params are the strings bound to the ? placeholders in sql.
+		Each row is turned into a record by calling record with an
+		iterable of its values, e.g. the _make method of a namedtuple.
+		"""
+		result = [record(r) for r in self.fetch(sql, types, params, packed)]
+		self.lastUsed = time.monotonic()
+		return result
+
+	def queryColumns(self, sql, types, params=(), packed=False):
+		"""Get the results of an SQL query column by column
+
+		Returns a list with one entry per column: an array('d') for
+		D columns, an array('q') for I columns and a tuple of strings
+		for S columns.
+		"""
+		result = columnsOf(self.fetch(sql, types, params, packed), types)
+		self.lastUsed = time.monotonic()
 		return result
 
 
+def columnsOf(rows, types):
+	"""Turn rows into columns, see BioOfficeConn.queryColumns"""
+	cols = [
+		array.array('d') if c == 'D' else array.array('q') if c == 'I' else []
+		for c in types
+	]
+	for row in rows:
+		for col, v in zip(cols, row):
+			col.append(v)
+	return [tuple(col) if c == 'S' else col for c, col in zip(types, cols)]
+
+
+# Separator of the fields of a packed row, see packcols
+PackSep = '\x1f'
+
+_convs = dict(
+	S=str,
+	D=lambda v: float(v) if v else 0.0,
+	I=lambda v: int(v) if v else 0,
+)
+
+
+def packcols(cols):
+	"""SQL expression combining cols into a single string
+
+	NULL values become empty strings, like getString would return.
+	Style 2 keeps the full precision of money and float columns.
+	"""
+	return " + CHAR(31) + ".join(
+		f"ISNULL(CONVERT(NVARCHAR(400), {c}, 2), '')" for c in cols
+	)
+
+
+class ConnectionPool:
+	"""Database connections shared by all queries
+
+	Connecting to the database is expensive, so connections are kept
+	open, one per data source name, for as long as the python process
+	lives, i.e. across several macro runs. Each thread gets its own
+	connections, see submit. A connection is checked before it is
+	handed out again and replaced when it went stale. The hits and
+	misses counters tell how often a connection could be reused and
+	how often a new one had to be made.
+	"""
+
+	MaxIdle = 60
+
+	def __init__(self):
+		self.conns = {}
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, source='bodb', factory=BioOfficeConn):
+		key = (source, threading.get_ident())
+		conn = self.conns.get(key)
+		if conn is not None:
+			if conn.isAlive(self.MaxIdle):
+				self.hits += 1
+				return conn
+			conn.close()
+		self.misses += 1
+		conn = self.conns[key] = factory(source)
+		return conn
+
+	def clear(self):
+		for conn in list(self.conns.values()):
+			conn.close()
+		self.conns.clear()
+
+	def stats(self):
+		return dict(hits=self.hits, misses=self.misses, open=len(self.conns))
+
+
+pool = ConnectionPool()
+
+
+def userProfile():
+	"""Path of the LibreOffice user profile"""
+	import uno
+	url = CC.ServiceManager.createInstanceWithContext(
+		"com.sun.star.util.PathSubstitution", CC
+	).substituteVariables('$(user)', True)
+	return uno.fileUrlToSystemPath(url)
+
+
+class ResultCache:
+	"""Query results stored on disk
+
+	The mornings' reports query the same rows over and over again, so
+	results are kept in files below directory (default: querycache in
+	the user profile), one file per distinct query, i.e. SQL text plus
+	parameters. A result is used for at most ttl seconds. If validate
+	is True, a cheap query (the CheckSQL of the query) tells whether
+	the data has changed on the server, and only then the full result
+	is transferred again. Only the maxentries most recently used
+	results are kept.
+	"""
+
+	def __init__(
+		self, directory=None, ttl=4 * 3600, maxentries=200, validate=True
+	):
+		self._directory = directory
+		self.ttl = ttl
+		self.maxentries = maxentries
+		self.validate = validate
+		self.hits = 0
+		self.misses = 0
+
+	@property
+	def directory(self):
+		if self._directory is None:
+			self._directory = os.path.join(userProfile(), 'querycache')
+		os.makedirs(self._directory, exist_ok=True)
+		return self._directory
+
+	def path(self, query, types):
+		key = repr((query.sql, query.params, types, query.packed))
+		name = hashlib.sha1(key.encode()).hexdigest()
+		return os.path.join(self.directory, name + '.pickle')
+
+	def check(self, query):
+		"""Result of the validation query for query"""
+		check = query.CheckSQL.format_map(query.__dict__)
+		return query.connection().queryResult(
+			check, 'II', query.checkParams
+		)[0]
+
+	def rows(self, query, types):
+		path = self.path(query, types)
+		try:
+			with open(path, 'rb') as f:
+				entry = pickle.load(f)
+		except Exception:
+			entry = None
+		check = None
+		if entry is not None and time.time() - entry['created'] < self.ttl:
+			if self.validate:
+				check = self.check(query)
+			if check == entry['check']:
+				self.hits += 1
+				# Mark as recently used
+				os.utime(path)
+				return entry['rows']
+		self.misses += 1
+		# The check must be done before fetching the rows, otherwise
+		# a change in between would go unnoticed next time.
+		if self.validate and check is None:
+			check = self.check(query)
+		rows = list(query.connection().fetch(
+			query.sql, types, query.params, query.packed
+		))
+		entry = dict(created=time.time(), check=check, rows=rows)
+		# Another thread or process (macros, psdaemon and psbatch share
+		# the directory) may be storing the same query
+		tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+		with open(tmp, 'wb') as f:
+			pickle.dump(entry, f)
+		os.replace(tmp, path)
+		self.evict()
+		return rows
+
+	def evict(self):
+		"""Remove the least recently used results beyond maxentries"""
+		with os.scandir(self.directory) as it:
+			entries = [e for e in it if e.name.endswith('.pickle')]
+		if len(entries) <= self.maxentries: return
+		entries.sort(key=lambda e: e.stat().st_mtime)
+		for e in entries[:len(entries) - self.maxentries]:
+			try:
+				os.remove(e.path)
+			except OSError:
+				pass
+
+	def clear(self):
+		for name in os.listdir(self.directory):
+			os.remove(os.path.join(self.directory, name))
+
+	def stats(self):
+		return dict(hits=self.hits, misses=self.misses)
+
+
+# The result cache used by all queries, see useCache
+cache = None
+
+
+def useCache(enabled=True, **opts):
+	"""Cache query results, opts are those of ResultCache
+
+	Called with enabled=False, the cache is switched off again.
+	"""
+	global cache
+	cache = ResultCache(**opts) if enabled else None
+
+
+# Columns of V_Artikelinfo and their types, as kept in the mirror
+MirrorCols = dict(
+	WG='S', EAN='S', Bezeichnung='S', VKEinheit='S', Wiegeartikel='S',
+	Land='S', iWG='S', LiefID='S', ArtNr='S', EK0='D', VKGH='D',
+	Hersteller='S', VK1='D', VK0='D', MwSt='D', LadenID='S', Waage='S'
+)
+
+
+def _sortkey(value):
+	value = value.rstrip().casefold()
+	base = ''.join(
+		c for c in unicodedata.normalize('NFKD', value)
+		if not unicodedata.combining(c)
+	)
+	return base, value
+
+
+def _collate(a, b):
+	"""Compare like the server does
+
+	Case and trailing blanks are ignored, accented letters sort
+	next to their base letters but are not equal to them.
+	"""
+	a, b = _sortkey(a), _sortkey(b)
+	return (a > b) - (a < b)
+
+
+class MirrorConn(BioOfficeConn):
+	"""Connection to a local SQLite mirror of V_Artikelinfo
+
+	See snapshot for how to create one. The text columns use the
+	collation BODB, which is only known to connections made here.
+	"""
+
+	def __init__(self, source):
+		import sqlite3
+		self.source = source
+		# Only used by the thread that made it, but closed by any
+		self.dbconn = sqlite3.connect(
+			f'file:{source}?mode=ro', uri=True, check_same_thread=False
+		)
+		self.dbconn.create_collation('BODB', _collate)
+		self.lastUsed = time.monotonic()
+
+	def isAlive(self, maxidle=60):
+		return True
+
+	def fetch(self, sql, types, params=(), packed=False):
+		convs = [_mirrorConvs[c] for c in types]
+		for row in self.dbconn.execute(sql, params):
+			yield tuple(conv(v) for conv, v in zip(convs, row))
+
+
+# Mimic getString/getDouble/getLong for NULL values
+_mirrorConvs = dict(
+	S=lambda v: '' if v is None else str(v),
+	D=lambda v: 0.0 if v is None else float(v),
+	I=lambda v: 0 if v is None else int(v),
+)
+
+
+def snapshot(path, source='bodb'):
+	"""Copy our part of V_Artikelinfo into the SQLite file path
+
+	The EAN is stored already converted to the string we use
+	everywhere. The file is replaced only once it is complete.
+	"""
+	import sqlite3
+	cols = [Query.EAN if c == 'EAN' else c for c in MirrorCols]
+	sql = f'SELECT {packcols(cols)} FROM V_Artikelinfo ' \
+		"WHERE LadenID = 'PLATTSALAT'"
+	types = ''.join(MirrorCols.values())
+	rows = pool.get(source).fetch(sql, types, packed=True)
+
+	tmp = path + '.tmp'
+	if os.path.exists(tmp): os.remove(tmp)
+	db = sqlite3.connect(tmp)
+	db.create_collation('BODB', _collate)
+	db.execute('CREATE TABLE V_Artikelinfo ({})'.format(', '.join(
+		f'{c} REAL' if t == 'D' else f'{c} TEXT COLLATE BODB'
+		for c, t in MirrorCols.items()
+	)))
+	db.executemany('INSERT INTO V_Artikelinfo VALUES ({})'.format(
+		','.join('?' for c in MirrorCols)
+	), rows)
+	for c in ('WG', 'iWG', 'LiefID', 'Waage'):
+		db.execute(f'CREATE INDEX idx_{c} ON V_Artikelinfo ({c})')
+	db.commit()
+	db.close()
+	os.replace(tmp, path)
+
+
+# Path of the SQLite mirror all queries use instead of the server,
+# see useMirror
+mirror = None
+
+
+def useMirror(path):
+	"""Run all queries against the mirror in path, None for the server"""
+	global mirror
+	mirror = path
+
+
+class Unchanged(Exception):
+	"""A report would come out the same as last time, see Fingerprint"""
+
+
+class Fingerprint:
+	"""Hash of everything a report is made from
+
+	It starts from parts like the name of the report and the version
+	of the code, then the results of all queries are added while it
+	is in use, see useFingerprint. The sheet of the report finally
+	adds its layout parameters with check, which raises Unchanged if
+	the hash is previous, the one of the last run. So reports must
+	run their queries before they create their sheet.
+	"""
+
+	def __init__(self, previous, *parts):
+		self.previous = previous
+		self.hash = hashlib.sha1()
+		# Submitted queries whose results are not added yet, see submit
+		self.pending = []
+		for part in parts:
+			self.add(part)
+
+	def add(self, value):
+		self.hash.update(repr(value).encode())
+
+	def hexdigest(self):
+		return self.hash.hexdigest()
+
+	def check(self, *params):
+		# Results still being fetched belong to the report as well
+		while self.pending:
+			self.pending[0].result()
+		self.add(params)
+		if self.hexdigest() == self.previous:
+			raise Unchanged(self.previous)
+
+
+# The fingerprint query results are added to, see useFingerprint
+fingerprint = None
+
+
+def useFingerprint(fp):
+	"""Add the results of all queries to fp, None to stop"""
+	global fingerprint
+	fingerprint = fp
+
+
+# Number of queries run at the same time, see submit. With 0, they run
+# right away on the calling thread: a macro run by LibreOffice holds
+# the SolarMutex while it waits for a result, and the worker threads
+# need it to connect to the data source. Only psbatch and psdaemon,
+# talking to LibreOffice over a socket, set it.
+Workers = 0
+_executor = None
+
+# State of the thread running a submitted query
+_worker = threading.local()
+
+
+class Pending:
+	"""The future result of a submitted query
+
+	Wraps a concurrent.futures.Future. Rows fetched in a worker thread
+	are added to the fingerprint only when the result is taken, so
+	its hash does not depend on which query finished first.
+	"""
+
+	def __init__(self, future, fingerprint):
+		self.future = future
+		self.fingerprint = fingerprint
+		if fingerprint is not None:
+			fingerprint.pending.append(self)
+
+	def done(self):
+		return self.future.done()
+
+	def result(self):
+		result, parts = self.future.result()
+		if self.fingerprint is not None and self in self.fingerprint.pending:
+			self.fingerprint.pending.remove(self)
+			for part in parts:
+				self.fingerprint.add(part)
+		return result
+
+
+def _collect(func, args):
+	_worker.parts = []
+	try:
+		return func(*args), _worker.parts
+	finally:
+		del _worker.parts
+
+
+def submit(func, *args):
+	"""Run func(*args) in a worker thread, returns a Pending
+
+	The workers get their own database connections from the pool, so
+	up to Workers queries run at the same time, and the macro may go
+	on, e.g. open its document, while they do. Without Workers, func
+	runs right here, and the Pending only hands out its result.
+	"""
+	global _executor
+	import concurrent.futures
+	if not Workers:
+		future = concurrent.futures.Future()
+		try:
+			future.set_result(_collect(func, args))
+		except Exception as e:
+			future.set_exception(e)
+		return Pending(future, fingerprint)
+	if _executor is None:
+		_executor = concurrent.futures.ThreadPoolExecutor(
+			max_workers=Workers, thread_name_prefix='bodb'
+		)
+	return Pending(_executor.submit(_collect, func, args), fingerprint)
+
+
 def mkincond(name, value):
-	lst = ','.join(f"'{v}'" for v in value)
+	lst = ','.join('?' for v in value)
 	return f'{name} IN ({lst})'
 
 
 def mkeqcond(name, value):
-	return f"{name} = '{value}'"
+	return f'{name} = ?'
 
 
 class Query(types.SimpleNamespace):
@@ -59,22 +570,253 @@ class Query(types.SimpleNamespace):
 	Cols = ["EAN", "Bezeichnung", "Land", "VK1", "VK0", "VKEinheit"]
 	SCols = "SSSDDS"
 
+	# Cheap query telling whether the result of SQL has changed, over
+	# all the columns it selects
+	CheckSQL = 'SELECT COUNT(*), CHECKSUM_AGG(CHECKSUM({checkCols})) ' \
+		"FROM V_Artikelinfo WHERE LadenID = 'PLATTSALAT' AND {cons}"
+
+	# Query of streamBatch, ordered by the position of the value of
+	# each row in the list of values, see there
+	StreamSQL = 'SELECT {cols} FROM (SELECT DISTINCT {inner}, {group} AS Grp ' \
+		"FROM V_Artikelinfo WHERE LadenID = 'PLATTSALAT' AND {cons}) AS t " \
+		'ORDER BY Grp, Bezeichnung'
+
 	CONDS = []
 
+	# Name of the registered data source to query
+	Source = 'bodb'
+
+	# Fetch each row as a single packed string, see packcols
+	Packed = True
+
 	def __init__(self, wg=None, iwg=None, liefer=None) -> None:
 		self.wg, self.iwg, self.liefer = wg, iwg, liefer
 
-	def run(self):
-		self.cols = ','.join(self.EAN if c == 'EAN' else f'{c}' for c in self.Cols)
-		conditions = self.CONDS.copy()
-		for n, name in dict(iwg='iWG', liefer='LiefID', wg='WG').items():
+	# Keyword arguments selecting rows and their column names
+	Filters = dict(iwg='iWG', liefer='LiefID', wg='WG')
+
+	def connection(self):
+		if mirror is not None:
+			return pool.get(mirror, MirrorConn)
+		return pool.get(self.Source)
+
+	def columns(self):
+		# The mirror stores the EAN already converted
+		ean = 'EAN' if mirror is not None else self.EAN
+		return [ean if c == 'EAN' else f'{c}' for c in self.Cols]
+
+	def conditions(self):
+		"""Conditions from the filter arguments given to this query
+
+		Returns the list of conditions, with placeholders instead of
+		the values, and the list of values to bind to them.
+		"""
+		conditions = []
+		params = []
+		for n, name in self.Filters.items():
 			value = self.__dict__[n]
 			if value is None: continue
 			if isinstance(value, list):
 				conditions.append(mkincond(name, value))
+				params += [str(v) for v in value]
 			else:
 				conditions.append(mkeqcond(name, value))
-		self.cons = ' AND '.join(conditions)
+				params.append(str(value))
+		return conditions, params
+
+	@classmethod
+	def record(cls):
+		"""The namedtuple type used for the rows of this query"""
+		if '_record' not in cls.__dict__:
+			cls._record = collections.namedtuple(cls.__name__ + 'Row', cls.Cols)
+		return cls._record
+
+	def compile(self, cols, conditions, params):
+		# The SQL only depends on the class and the shape of the
+		# filters, so the connection can reuse its prepared statement.
+		# Packing only saves bridge calls, the mirror has none
+		self.packed = self.Packed and mirror is None
+		if self.packed:
+			# Bezeichnung is needed as well, as SELECT DISTINCT
+			# may only be ordered by selected columns
+			self.cols = packcols(cols) + ',Bezeichnung'
+		else:
+			self.cols = ','.join(cols)
+		self.cons = ' AND '.join(self.CONDS + conditions)
 		self.sql = self.SQL.format_map(self.__dict__)
-		# log.debug(f'Query: {self.sql}')
-		return BioOfficeConn().queryResult(self.sql, self.SCols)
+		self.params = params
+		# The CheckSQL of the result cache only has the conditions,
+		# and the columns unpacked
+		self.checkParams = params
+		self.checkCols = ','.join(cols)
+		# log.debug(f'Query: {self.sql} {params}')
+
+	def rows(self, types):
+		"""The rows of the compiled query as tuples
+
+		They come from the result cache if one is in use, unless
+		the query runs against the mirror. They are added to the
+		fingerprint, if one is in use.
+		"""
+		if cache is not None and mirror is None:
+			rows = cache.rows(self, types)
+		else:
+			rows = self.connection().fetch(
+				self.sql, types, self.params, self.packed
+			)
+		if fingerprint is not None:
+			rows = list(rows)
+			parts = getattr(_worker, 'parts', None)
+			if parts is None:
+				fingerprint.add((self.cons, self.params, rows))
+			else:
+				parts.append((self.cons, self.params, rows))
+		return rows
+
+	def execute(self, types, record=tuple):
+		return [record(r) for r in self.rows(types)]
+
+	def run(self):
+		"""Get the result as a list of records, see record()"""
+		self.compile(self.columns(), *self.conditions())
+		return self.execute(self.SCols, self.record()._make)
+
+	def runColumns(self):
+		"""Get the result column by column
+
+		Returns a record (see record()) whose fields hold all values
+		of the respective column, see BioOfficeConn.queryColumns.
+		"""
+		self.compile(self.columns(), *self.conditions())
+		return self.record()._make(
+			columnsOf(self.rows(self.SCols), self.SCols)
+		)
+
+	def submit(self):
+		"""Start run in a worker thread, returns a Pending, see submit"""
+		return submit(self.run)
+
+	def submitColumns(self):
+		"""Start runColumns in a worker thread, see submit"""
+		return submit(self.runColumns)
+
+	def matches(self, values):
+		"""Check if a row belongs to this query
+
+		values maps filter argument names to the row's content of the
+		corresponding column. The comparison mimics the one of the
+		database, i.e. ignores case and trailing blanks.
+		"""
+		for n, value in values.items():
+			want = self.__dict__[n]
+			if want is None: continue
+			if not isinstance(want, list): want = [want]
+			if _norm(value) not in (_norm(w) for w in want):
+				return False
+		return True
+
+	@classmethod
+	def runBatch(cls, *filters):
+		"""Run several queries of this class in a single round trip
+
+		Each of filters is a dict with the keyword arguments of one
+		query. The conditions of all queries are combined with OR and
+		the columns needed to tell the queries apart are fetched as
+		well, so the rows can be split up again afterwards. Returns
+		a list with the results of each query, the same as running
+		each query on its own would give.
+		"""
+		queries = [cls(**f) for f in filters]
+		if len(queries) < 2:
+			return [q.run() for q in queries]
+		used = [
+			n for n in cls.Filters
+			if any(q.__dict__[n] is not None for q in queries)
+		]
+		alternatives = []
+		params = []
+		for q in queries:
+			conditions, p = q.conditions()
+			alternatives.append('(' + (' AND '.join(conditions) or '1 = 1') + ')')
+			params += p
+		batch = cls()
+		batch.compile(
+			batch.columns() + [cls.Filters[n] for n in used],
+			['(' + ' OR '.join(alternatives) + ')'],
+			params
+		)
+		rows = batch.execute(cls.SCols + 'S' * len(used))
+		ncols = len(cls.Cols)
+		record = cls.record()._make
+		results = [[] for q in queries]
+		seen = [set() for q in queries]
+		for row in rows:
+			values = dict(zip(used, row[ncols:]))
+			data = row[:ncols]
+			for i, q in enumerate(queries):
+				if not q.matches(values): continue
+				# The discriminating columns may have split up rows
+				# that are identical otherwise.
+				if data in seen[i]: continue
+				seen[i].add(data)
+				results[i].append(record(data))
+		return results
+
+	@classmethod
+	def streamBatch(cls, name, values, **filters):
+		"""Run a query for each of values of the filter name, as one
+
+		Like runBatch with the filters dict(filters, name=value) for
+		each value, but the rows are ordered by the position of their
+		value in values, so they can be handed on group by group as
+		they come from the cursor. Returns an iterator of (value, rows)
+		for the values that have rows, rows being an iterator of the
+		records (see record()). The rows of a group must be used up
+		before the next group is taken. With a fingerprint or the
+		result cache in use, the query is run and all its rows fetched
+		right away, so they are part of the fingerprint. Otherwise it
+		only runs when the first group is taken, and the rows come
+		from the cursor.
+		"""
+		values = list(values)
+		batch = cls(**filters, **{name: values})
+		conditions, params = batch.conditions()
+		batch.inner = ','.join(
+			f'{e} AS {c}' for e, c in zip(batch.columns(), cls.Cols)
+		)
+		batch.group = 'CASE {} {} END'.format(
+			cls.Filters[name], ' '.join(f'WHEN ? THEN {i}' for i in range(len(values)))
+		)
+		batch.compile(cls.Cols + ['Grp'], conditions, params)
+		# The placeholders of group come first, and the columns of
+		# the check are those of the inner query
+		batch.params = [str(v) for v in values] + params
+		batch.checkCols = ','.join(batch.columns())
+		batch.sql = cls.StreamSQL.format_map(batch.__dict__)
+		rows = batch.rows(cls.SCols + 'I')
+		ncols = len(cls.Cols)
+		record = cls.record()._make
+
+		def groups():
+			for i, group in itertools.groupby(rows, key=lambda row: row[ncols]):
+				yield values[i], (record(row[:ncols]) for row in group)
+		return groups()
+
+	@classmethod
+	def submitBatch(cls, *filters):
+		"""Start runBatch in a worker thread, see submit"""
+		return submit(cls.runBatch, *filters)
+
+
+def _norm(value):
+	return str(value).rstrip().casefold()
+
+
+if __name__ == '__main__':
+	# Create a mirror, needs LibreOffice listening on port 2002
+	import sys
+	import offi
+	if len(sys.argv) != 3 or sys.argv[1] != 'snapshot':
+		sys.exit(f'usage: {sys.argv[0]} snapshot <sqlite file>')
+	mkcctx(offi.init().ctx)
+	snapshot(sys.argv[2])
@@ -0,0 +1,94 @@
+"""Width of text in the default font, computed in python
+
+The default font of our documents is Liberation Sans, which has the
+same metrics as Helvetica (and Arial), so the widths of the Helvetica
+AFM files are used. Widths are in 1/1000 of the font size, for the
+characters from space to tilde.
+"""
+import functools
+import unicodedata
+
+Regular = [
+	278, 278, 355, 556, 556, 889, 667, 191,
+	333, 333, 389, 584, 278, 333, 278, 278,
+	556, 556, 556, 556, 556, 556, 556, 556,
+	556, 556, 278, 278, 584, 584, 584, 556,
+	1015, 667, 667, 722, 722, 667, 611, 778,
+	722, 278, 500, 667, 556, 833, 722, 778,
+	667, 778, 722, 667, 611, 722, 667, 944,
+	667, 667, 611, 278, 278, 278, 469, 556,
+	333, 556, 556, 500, 556, 556, 278, 556,
+	556, 222, 222, 500, 222, 833, 556, 556,
+	556, 556, 333, 500, 278, 556, 500, 722,
+	500, 500, 500, 334, 260, 334, 584,
+]
+
+Bold = [
+	278, 333, 474, 556, 556, 889, 722, 238,
+	333, 333, 389, 584, 278, 333, 278, 278,
+	556, 556, 556, 556, 556, 556, 556, 556,
+	556, 556, 333, 333, 584, 584, 584, 611,
+	975, 722, 722, 722, 722, 667, 611, 778,
+	722, 278, 556, 722, 611, 833, 722, 778,
+	667, 778, 722, 667, 611, 722, 667, 944,
+	667, 667, 611, 333, 278, 333, 584, 556,
+	333, 556, 611, 556, 611, 556, 333, 611,
+	611, 278, 278, 556, 278, 889, 611, 611,
+	611, 611, 389, 556, 333, 611, 556, 778,
+	556, 556, 500, 389, 280, 389, 584,
+]
+
+# Characters outside of ASCII that neither decompose into one
+Special = {'ß': (611, 611), '€': (556, 556), '°': (400, 400), '½': (834, 834)}
+
+# Width of anything else
+Default = 556
+
+# Height of a line, ascent plus descent, in 1/1000 of the font size
+LineHeight = 1117
+
+# Space LibreOffice adds to the text width for the optimal column
+# width, in 1/100 mm
+Extra = 200
+
+
+@functools.lru_cache(maxsize=None)
+def charWidth(c, bold=False):
+	if c in Special:
+		return Special[c][bold]
+	if not ' ' <= c <= '~':
+		# Accented letters are as wide as their base letter
+		c = unicodedata.normalize('NFKD', c)[:1]
+		if not ' ' <= c <= '~':
+			return Default
+	return (Bold if bold else Regular)[ord(c) - 32]
+
+
+@functools.lru_cache(maxsize=8192)
+def textWidth(text, size=12, bold=False):
+	"""Width of text at size points in 1/100 mm
+
+	For multi-line text, the longest line counts.
+	"""
+	units = max(
+		sum(charWidth(c, bold) for c in line) for line in text.split('\n')
+	)
+	return round(units * size * 2540 / 72 / 1000)
+
+
+def columnWidth(texts, size=12, bold=False, margins=0):
+	"""Width a column needs to show all of texts without clipping
+
+	margins is the sum of the left and right paragraph margins.
+	"""
+	widest = max((textWidth(t, size, bold) for t in texts), default=0)
+	return widest + margins + Extra
+
+
+def textHeight(text, size=12):
+	"""Height of a cell showing text at size points in 1/100 mm
+
+	This is what LibreOffice makes the optimal height of a row.
+	"""
+	lines = text.count('\n') + 1
+	return round(lines * LineHeight * size * 2540 / 72 / 1000) + 58
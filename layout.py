@@ -0,0 +1,409 @@
+"""Placement of lists on a sheet
+
+Where each value, label and style goes only depends on the lengths of
+the lists and a few parameters, so it is computed here in pure python,
+without any LibreOffice objects. The resulting plans are immutable and
+cached, Sheet then executes them.
+"""
+import collections
+import functools
+import numbers
+
+import bodb
+import fontmetrics
+
+Pos = collections.namedtuple('Pos', 'x y')
+
+# Contiguous rows of list number lst in one column of lists, starting
+# at x, y. Each list is styled block by block.
+Block = collections.namedtuple('Block', 'lst x y rows')
+
+Plan = collections.namedtuple('Plan', [
+	'cols',        # number of columns of lists side by side
+	'colCols',     # number of sheet columns of each list
+	'titlerows',   # rows at the top repeated on every page
+	'totalRows',   # rows used below the title rows
+	'totalCols',   # sheet columns used
+	'headers',     # Pos of the label of each list
+	'places',      # Pos of each row of each list
+	'blocks',      # Blocks, in the order of the lists
+	'breaks',      # rows starting a new page
+])
+
+
+def _blocks(places):
+	blocks = []
+	for lst, rows in enumerate(places):
+		for p in rows:
+			if blocks and blocks[-1].lst == lst and blocks[-1].x == p.x \
+					and blocks[-1].y + blocks[-1].rows == p.y:
+				blocks[-1] = blocks[-1]._replace(rows=blocks[-1].rows + 1)
+			else:
+				blocks.append(Block(lst, p.x, p.y, 1))
+	return tuple(blocks)
+
+
+@functools.lru_cache(maxsize=64)
+def planData(lengths, cols, colCols, titlerows=0):
+	"""Plan for Sheet.addData
+
+	lengths are the lengths of the lists, which are distributed over
+	cols columns of lists, each colCols sheet columns wide, with an
+	empty sheet column in between.
+	"""
+	if colCols == 0:
+		raise ValueError('All lists are empty')
+	# Each list starts with a Label, using a single row
+	# then one row for each member and another row to separate
+	# the list from the next one. The total numer of rows
+	# is TR = <number of lists> * 2 - 1 + <sum of list lengths>
+	needed = len(lengths) * 2 - 1 + sum(lengths)
+	# We want to divide these equally over all columns,
+	# so we round up to the next multiple of cols and
+	# get the actual number of sheet rows
+	totalRows = (needed + cols-1) // cols
+	rest = totalRows * cols - needed
+
+	x, y = 0, titlerows
+
+	def advance():
+		nonlocal x, y
+		# go one down
+		y += 1
+		# if at bottom row, go to top and left
+		if y == totalRows + titlerows:
+			x = x + colCols + 1
+			y = titlerows
+
+	headers = []
+	places = []
+	for n in lengths:
+		headers.append(Pos(x, y))
+		# advance once, to get room for the label
+		if len(lengths) > 1:
+			advance()
+		rows = []
+		for i in range(n):
+			rows.append(Pos(x, y))
+			advance()
+		places.append(tuple(rows))
+		# advance once at the end of a list
+		advance()
+		if rest > 0:
+			advance()
+			rest -= 1
+	return Plan(
+		cols, colCols, titlerows, totalRows, cols * (colCols + 1) - 1,
+		tuple(headers), tuple(places), _blocks(places), ()
+	)
+
+
+@functools.lru_cache(maxsize=64)
+def planPagelist(lengths, colCols, titlerows=0):
+	"""Plan for BaseSheet.streamPagelist
+
+	Every list gets a page of its own, every row of a list takes two
+	sheet rows.
+	"""
+	crow = titlerows
+	places = []
+	breaks = []
+	for n in lengths:
+		if crow > titlerows:
+			breaks.append(crow)
+		places.append(tuple(Pos(0, crow + 2 * i) for i in range(n)))
+		crow += 2 * n
+	blocks = tuple(
+		Block(lst, 0, rows[0].y, 2 * len(rows))
+		for lst, rows in enumerate(places) if rows
+	)
+	return Plan(
+		1, colCols, titlerows, crow - titlerows, colCols,
+		(), tuple(places), blocks, tuple(breaks)
+	)
+
+
+def isPieceUnit(val):
+	"""Check if a unit denotes discrete pieces (like St or Bd)"""
+	return isinstance(val, str) and len(val) == 2 and val != 'Kg'
+
+
+def cellValue(val):
+	"""The value for a cell as setDataArray wants it"""
+	if isinstance(val, numbers.Number) and val < 2000000000:
+		return float(val)
+	return str(val)
+
+
+def fillGrids(plan, lists):
+	"""Place the values of lists according to a plan of planData
+
+	Returns one grid (a list of rows) for each column of lists and
+	the set of (grid, column) pairs holding prices.
+	"""
+	grids = [
+		[[''] * plan.colCols for r in range(plan.totalRows)]
+		for t in range(plan.cols)
+	]
+	currencyCols = set()
+	for lst, rows in zip(lists, plan.places):
+		for row, p in zip(lst, rows):
+			t = p.x // (plan.colCols + 1)
+			line = grids[t][p.y - plan.titlerows]
+			for i, val in enumerate(row):
+				line[i] = cellValue(val)
+				if isinstance(val, float):
+					currencyCols.add((t, i))
+	return grids, currencyCols
+
+
+# Columns of a page list whose cells span both rows of a row, see pageGrid
+PageMerged = (0, 1, 3, 4)
+
+
+def pageGrid(rows):
+	"""Values of a page of a page list, two lines for each of rows
+
+	The first five fields of a row go to the first line, where the
+	fourth field is replaced by the fifth and the sixth, the prices.
+	The fourth field (the unit) goes below the third.
+	"""
+	grid = []
+	for row in rows:
+		grid.append((
+			cellValue(row[0]), cellValue(row[1]), cellValue(row[2]),
+			float(row[4]), float(row[5])
+		))
+		grid.append(('', '', cellValue(row[3]), '', ''))
+	return grid
+
+
+def matchingCells(plan, lists, rule):
+	"""Find the values of lists for which rule returns True
+
+	Returns a dict mapping the column of the lists to the Pos of the
+	matching cells in that column.
+	"""
+	cells = {}
+	for lst, rows in zip(lists, plan.places):
+		for row, p in zip(lst, rows):
+			for i, val in enumerate(row):
+				if rule(val):
+					cells.setdefault(i, []).append(Pos(p.x + i, p.y))
+	return cells
+
+
+def rowKinds(plan):
+	"""Kind of content of every sheet row
+
+	Returns a tuple for each row, with an entry for each column of
+	lists: 'D' for a row of a list, 'd' for the second row of a row in
+	a page list, 'L' for a label and '' for nothing. Title rows are
+	('T',). Rows of the same kind have the same height.
+	"""
+	kinds = [[''] * plan.cols for y in range(plan.titlerows + plan.totalRows)]
+	for b in plan.blocks:
+		t = b.x // (plan.colCols + 1)
+		for y in range(b.y, b.y + b.rows):
+			kinds[y][t] = 'd'
+	for rows in plan.places:
+		for p in rows:
+			kinds[p.y][p.x // (plan.colCols + 1)] = 'D'
+	for p in plan.headers:
+		kinds[p.y][p.x // (plan.colCols + 1)] = 'L'
+	for y in range(plan.titlerows):
+		kinds[y] = ['T']
+	return [tuple(k) for k in kinds]
+
+
+class BaseSheet:
+	"""What all kinds of sheets do the same way
+
+	Subclasses write the cells, see Psmacros.Sheet for a document in
+	LibreOffice and odsheet.OdsSheet for an .ods file written directly.
+	They provide writeGrids, writePage, the styles named in addData,
+	stretchRows, and measureWidth and measureRow for columns and rows whose size
+	was not set. Creating a sheet raises bodb.Unchanged if the report
+	would come out the same as last time, see bodb.Fingerprint. A
+	sheet created with a book, another sheet, is added to the document
+	of that one. Only the first sheet of a document is checked.
+	"""
+
+	# Row heights by layoutKey and kind of row, see rowRuns
+	rowHeights = {}
+
+	def __init__(self, name, cols, titlerows=0, book=None):
+		if bodb.fingerprint is not None and book is None:
+			bodb.fingerprint.check(type(self).__name__, name, cols, titlerows)
+		self.name = name
+		self.cols = cols
+		self.titlerows = titlerows
+		self.ColDefs = []
+		# Known column widths, and what else decides row heights,
+		# see getOptimalScale
+		self.colWidths = {}
+		self.labelHeight = None
+		self.titles = None
+
+	def addColumns(self, cols):
+		self.ColDefs += cols
+
+	def addData(self, *lists, style='Block'):
+		currencyCols = self.planLists(lists, style)
+		self.writeGrids(self.grids, currencyCols)
+		styler = getattr(self, 'style'+style)
+		for b in self.plan.blocks:
+			styler(b.x, b.y, self.colCols, b.rows)
+
+	def planLists(self, lists, style):
+		"""Plan the placement of lists for addData and fill the grids
+
+		Returns the (grid, column) pairs holding prices.
+		"""
+		# colCols is the number of columns in each list. All lists
+		# are supposed to have the same number of columns.
+		colCols = max(len(ll[0]) if len(ll) > 0 else 0 for ll in lists)
+		self.usePlan(planData(
+			tuple(len(ll) for ll in lists), self.cols, colCols, self.titlerows
+		))
+		self.grids, currencyCols = fillGrids(self.plan, lists)
+		# Paragraph margins of styleBlock, needed for text widths
+		self.textMargins = 200 if style == 'Block' else 0
+		self.unitCells = matchingCells(self.plan, lists, isPieceUnit)
+		return currencyCols
+
+	def addPagelist(self, *lists, style='Block', hstretch=1.2):
+		"""Add a list on a page of its own for each of lists"""
+		self.streamPagelist(((None, lst) for lst in lists), style)
+
+	def streamPagelist(self, pages, style='Block'):
+		"""Add a page list from pages, an iterable of (name, rows)
+
+		Each row takes two sheet rows, every list a page of its own.
+		The pages are written one by one as they come, see writePage,
+		so only the rows of one page are kept, and pages may come
+		straight from a cursor, see bodb.Query.streamBatch.
+		"""
+		styler = getattr(self, 'style'+style)
+		lengths = []
+		colCols = 0
+		y = self.titlerows
+		for name, rows in pages:
+			rows = list(rows)
+			if not rows: continue
+			colCols = len(rows[0])
+			self.writePage(y, rows, newPage=bool(lengths))
+			styler(0, y, colCols-1, 2 * len(rows))
+			lengths.append(len(rows))
+			y += 2 * len(rows)
+		self.usePlan(planPagelist(tuple(lengths), colCols, self.titlerows))
+
+	def usePlan(self, plan):
+		self.plan = plan
+		# Values written by addData, one grid per column of lists
+		self.grids = None
+		# Cells holding a piece unit, by column of the lists
+		self.unitCells = {}
+		self.colCols = plan.colCols
+		self.totalRows = plan.totalRows
+		self.totalCols = plan.totalCols
+		self.HeaderPositions = list(plan.headers)
+
+	def optimalWidth(self, x, cdef):
+		"""Width column x needs for its values, computed from the grids
+
+		Returns None if the values are not known, i.e. for a page list.
+		"""
+		if self.grids is None:
+			return None
+		t, i = divmod(x, self.colCols + 1)
+		return fontmetrics.columnWidth(
+			{line[i] for line in self.grids[t] if isinstance(line[i], str)},
+			cdef.height, cdef.bold, self.textMargins
+		)
+
+	def colWidth(self, x):
+		"""Width of column x, known without asking if we set it"""
+		if x not in self.colWidths:
+			self.colWidths[x] = self.measureWidth(x)
+		return self.colWidths[x]
+
+	def layoutKey(self):
+		"""Everything besides the kind of content that decides row heights"""
+		return (
+			self.name, self.titles, self.labelHeight,
+			tuple((c.height, c.bold) for c in self.ColDefs)
+		)
+
+	def rowRuns(self, y0, y1):
+		"""Heights of the rows y0 to y1 - 1
+
+		Returns a list of (y, n, height): n rows from y on, each of the
+		given height. Rows with the same kind of content (see rowKinds)
+		have the same height, so only one row of each kind is measured,
+		and that only once per process.
+		"""
+		kinds = rowKinds(self.plan)
+		key = self.layoutKey()
+		runs = []
+		for y in range(y0, y1):
+			k = (key, kinds[y])
+			if k not in self.rowHeights:
+				self.rowHeights[k] = self.measureRow(y)
+			if runs and runs[-1][2] == self.rowHeights[k]:
+				runs[-1][1] += 1
+			else:
+				runs.append([y, 1, self.rowHeights[k]])
+		return runs
+
+	def getOptimalScale(self, header=False):
+		"""Calculate the optimal scale factor in percent
+		"""
+		w = sum(self.colWidth(i) for i in range(self.totalCols))
+		runs = self.rowRuns(0, self.totalRows)
+		h = sum(n * height for y, n, height in runs)
+		if h == 0 or w == 0: return 100  # should not happen
+		ws = 19500 / w  # factor to scale to 195mm width
+		hs = 28200 / h  # factor to scale to 270mm height
+		# We must use the smaller of the two for scaling.
+		# If hs is smaller, the resulting height is at the maximum,
+		# and we only might make the Columns a bit wider, but we don't
+		if hs < ws: return int(hs * 100)
+		# If ws is smaller, the resulting width is at the maximum.
+		# In that case we can still make each row a bit higher to increase
+		# readability
+		hstretch = 28200 / (h * ws)
+		if hstretch > 1.5: hstretch = 1.5
+		self.stretchRows(runs, hstretch)
+		return int(ws * 100)
+
+	def getOptimalScaleExt(self, landscape, pages, header=False):
+		nrows = (self.totalRows + pages-1) // pages
+		w = sum(self.colWidth(i) for i in range(self.totalCols))
+		h = sum(
+			n * height for y, n, height in
+			self.rowRuns(self.titlerows, self.titlerows + nrows) +
+			self.rowRuns(0, self.titlerows)
+		)
+		if h == 0 or w == 0: return 100  # should not happen
+		if landscape:
+			towidth = 28400
+			toheight = 19800
+		else:
+			towidth = 19800
+			toheight = 28400
+		if header:
+			toheight -= 900
+		ws = towidth / w
+		hs = toheight / h
+		if hs < ws: return int(hs * 100)
+		hstretch = toheight / (h * ws)
+		if hstretch > 1.8: hstretch = 1.8
+		self.stretchRows(self.rowRuns(self.titlerows, self.totalRows), hstretch)
+		return int(ws * 100)
+
+	def pageScale(self, landscape=False, pages=1, header=False):
+		"""Scale in percent fitting the sheet on pages, see setPageStyle"""
+		if landscape or pages > 1:
+			return self.getOptimalScaleExt(landscape, pages, header=header)
+		return self.getOptimalScale(header=header)
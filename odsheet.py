@@ -0,0 +1,474 @@
+"""Sheets written directly as .ods files, without LibreOffice
+
+OdsSheet has the same methods as Psmacros.Sheet, so the report
+functions run unchanged in a plain python (see Psmacros.useDirect).
+Cells and their formatting are collected in dicts, save then streams
+content.xml row by row into the zip file. Sizes LibreOffice would
+measure are computed with fontmetrics.
+"""
+import datetime
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+
+import fontmetrics
+import layout
+
+# Documents created since the last run, by their first sheet
+documents = []
+
+# Width of a column that was never set, in 1/100 mm
+DefaultWidth = 2258
+
+Namespaces = ' '.join(f'xmlns:{k}="{v}"' for k, v in dict(
+	office='urn:oasis:names:tc:opendocument:xmlns:office:1.0',
+	style='urn:oasis:names:tc:opendocument:xmlns:style:1.0',
+	text='urn:oasis:names:tc:opendocument:xmlns:text:1.0',
+	table='urn:oasis:names:tc:opendocument:xmlns:table:1.0',
+	fo='urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0',
+	number='urn:oasis:names:tc:opendocument:xmlns:datastyle:1.0',
+	svg='urn:oasis:names:tc:opendocument:xmlns:svg-compatible:1.0',
+).items())
+
+Manifest = (
+	'<?xml version="1.0" encoding="UTF-8"?>\n'
+	'<manifest:manifest'
+	' xmlns:manifest="urn:oasis:names:tc:opendocument:xmlns:manifest:1.0"'
+	' manifest:version="1.2">\n'
+	' <manifest:file-entry manifest:full-path="/" manifest:version="1.2"'
+	' manifest:media-type="application/vnd.oasis.opendocument.spreadsheet"/>\n'
+	' <manifest:file-entry manifest:full-path="content.xml"'
+	' manifest:media-type="text/xml"/>\n'
+	' <manifest:file-entry manifest:full-path="styles.xml"'
+	' manifest:media-type="text/xml"/>\n'
+	'</manifest:manifest>\n'
+)
+
+FontFaces = (
+	'<office:font-face-decls><style:font-face style:name="Liberation Sans"'
+	' svg:font-family="&apos;Liberation Sans&apos;"'
+	' style:font-family-generic="swiss"'
+	' style:font-pitch="variable"/></office:font-face-decls>'
+)
+
+# The named styles of Psmacros.defineStyles
+CurrencyNumber = (
+	'<number:number number:decimal-places="2" number:min-integer-digits="1"'
+	' number:grouping="true"/><number:text> </number:text>'
+	'<number:currency-symbol number:language="de" number:country="DE">'
+	'€</number:currency-symbol>'
+)
+NamedStyles = (
+	'<office:styles>\n'
+	'<number:currency-style style:name="N108P0" style:volatile="true">'
+	f'{CurrencyNumber}</number:currency-style>\n'
+	'<number:currency-style style:name="N108">'
+	'<style:text-properties fo:color="#ff0000"/><number:text>-</number:text>'
+	f'{CurrencyNumber}<style:map style:condition="value()&gt;=0"'
+	' style:apply-style-name="N108P0"/></number:currency-style>\n'
+	'<style:style style:name="Default" style:family="table-cell">'
+	'<style:text-properties style:font-name="Liberation Sans"'
+	' fo:font-size="12pt"/></style:style>\n'
+	'<style:style style:name="PS Bold" style:family="table-cell"'
+	' style:parent-style-name="Default">'
+	'<style:text-properties fo:font-weight="bold"/></style:style>\n'
+	'<style:style style:name="PS Price" style:family="table-cell"'
+	' style:parent-style-name="Default" style:data-style-name="N108"/>\n'
+	'<style:style style:name="PS Unit" style:family="table-cell"'
+	' style:parent-style-name="Default">'
+	'<style:text-properties fo:font-weight="bold"/></style:style>\n'
+	'</office:styles>'
+)
+
+Justify = dict(left='start', center='center', right='end')
+
+Border = '0.05mm solid #000000'
+
+
+def mm(hmm):
+	"""Length in 1/100 mm as ODF wants it"""
+	return f'{hmm / 100:g}mm'
+
+
+def cellStyleXml(name, props):
+	parent = props.get('style', 'Default')
+	cell = []
+	if 'vjust' in props:
+		cell.append(f'style:vertical-align="{props["vjust"]}"')
+	for side in ('left', 'right', 'top', 'bottom'):
+		if props.get(side):
+			cell.append(f'fo:border-{side}="{Border}"')
+	if 'background' in props:
+		cell.append(f'fo:background-color="#{props["background"]:06x}"')
+	para = []
+	if 'hjust' in props:
+		cell.append('style:text-align-source="fix"')
+		para.append(f'fo:text-align="{Justify[props["hjust"]]}"')
+	if props.get('margins'):
+		para += ['fo:margin-left="1mm"', 'fo:margin-right="1mm"']
+	text = []
+	if 'height' in props:
+		text.append(f'fo:font-size="{props["height"]}pt"')
+	if props.get('bold'):
+		text.append('fo:font-weight="bold"')
+	xml = f'<style:style style:name="{name}" style:family="table-cell"' \
+		f' style:parent-style-name={quoteattr(parent)}>'
+	for element, attrs in (
+		('table-cell-properties', cell), ('paragraph-properties', para),
+		('text-properties', text)
+	):
+		if attrs:
+			xml += f'<style:{element} {" ".join(attrs)}/>'
+	return xml + '</style:style>'
+
+
+class OdsSheet(layout.BaseSheet):
+	"""A single sheet to be filled with tables, saved as .ods file
+
+	Sheets created with a book are added to its document, see
+	Psmacros.Sheet.
+	"""
+
+	# Estimated row heights, see rowRuns
+	rowHeights = {}
+
+	def __init__(self, name, cols, titlerows=0, book=None):
+		super().__init__(name, cols, titlerows, book)
+		# Values and formatting by (x, y), formatting of whole columns
+		# by x, the merged cells by their top left (x, y) with the
+		# number of rows
+		self.cells = {}
+		self.props = {}
+		self.colProps = {}
+		self.spans = {}
+		self.breaks = set()
+		self.heights = {}
+		self.repeatRows = 0
+		self.page = dict(landscape=False, scale=100, date=None)
+		if book is None:
+			# The sheets of the document, each with its own page style
+			self.sheets = [self]
+			self.pageStyle = 'PS Report'
+			documents.append(self)
+		else:
+			book.sheets.append(self)
+			self.pageStyle = f'PS Report {name}'
+
+	def keepSheets(self, names):
+		"""A new document has the sheets added to it only"""
+
+	def setProps(self, x0, y0, x1, y1, **props):
+		for x in range(x0, x1 + 1):
+			for y in range(y0, y1 + 1):
+				self.props.setdefault((x, y), {}).update(props)
+
+	def styleBlock(self, x, y, n, rows=1):
+		"""Style rows, Blocks with lines everywhere."""
+		self.setProps(
+			x, y, x + n - 1, y + rows - 1,
+			left=True, right=True, top=True, bottom=True, margins=True
+		)
+
+	def styleAltGrey(self, x, y, n, rows=1):
+		"""Style rows, Alternating grey background
+		"""
+		y1 = y + rows - 1
+		self.setProps(x, y, x, y1, left=True)
+		self.setProps(x + n - 1, y, x + n - 1, y1, right=True)
+		for r in range(y | 1, y1 + 1, 2):
+			self.setProps(x, r, x + n - 1, r, background=0xdddddd)
+
+	def writeGrids(self, grids, currencyCols):
+		y0 = self.titlerows
+		for t, grid in enumerate(grids):
+			x0 = t * (self.colCols + 1)
+			for r, line in enumerate(grid):
+				for i, val in enumerate(line):
+					if val != '':
+						self.cells[x0 + i, y0 + r] = val
+		for t, i in sorted(currencyCols):
+			x = t * (self.colCols + 1) + i
+			self.setProps(x, y0, x, y0 + self.totalRows - 1, style='PS Price')
+
+	def setMerged(self, x, y, val):
+		self.spans[x, y] = 2
+		self.cells[x, y] = val
+
+	def writePage(self, y, rows, newPage):
+		"""Write a page of a page list, see Psmacros.Sheet"""
+		if newPage:
+			self.breaks.add(y)
+		for r, line in enumerate(layout.pageGrid(rows), y):
+			top = (r - y) % 2 == 0
+			for x, val in enumerate(line):
+				if x not in layout.PageMerged:
+					self.cells[x, r] = val
+				elif top:
+					self.setMerged(x, r, val)
+			if top:
+				self.setProps(3, r, 4, r, style='PS Price')
+
+	def charHeight(self, x, y):
+		props = self.props.get((x, y), {})
+		return props.get('height', self.colProps.get(x, {}).get('height', 12))
+
+	def measureWidth(self, x):
+		return DefaultWidth
+
+	def measureRow(self, y):
+		"""Optimal height of row y, merged cells do not count"""
+		covered = {(x, y0 + 1) for x, y0 in self.spans}
+		return max((
+			fontmetrics.textHeight(str(val), self.charHeight(x, y))
+			for (x, cy), val in self.cells.items()
+			if cy == y and (x, y) not in self.spans and (x, y) not in covered
+		), default=fontmetrics.textHeight('', 12))
+
+	def stretchRows(self, runs, hstretch):
+		for y, n, height in runs:
+			for r in range(y, y + n):
+				self.heights[r] = int(height * hstretch)
+
+	def formatCol(self, i, cdef):
+		if cdef.tryOptWidth:
+			width = self.optimalWidth(i, cdef)
+			if width is None:
+				width = fontmetrics.columnWidth(
+					{v for (x, y), v in self.cells.items() if x == i and isinstance(v, str)},
+					cdef.height, cdef.bold
+				)
+			self.colWidths[i] = min(width, cdef.width * 100)
+		else:
+			self.colWidths[i] = cdef.width * 100
+		props = self.colProps.setdefault(i, {})
+		if cdef.height != 12:
+			props['height'] = cdef.height
+		if cdef.hright:
+			props['hjust'] = 'right'
+		if cdef.hleft:
+			props['hjust'] = 'left'
+		props['vjust'] = 'middle'
+
+	def formatColumns(self):
+		for i, cdef in enumerate(self.ColDefs):
+			if cdef.greyUnit:
+				for p in self.unitCells.get(i, ()):
+					self.setProps(*p, *p, style='PS Unit')
+		for t in range(self.cols):
+			for i, cdef in enumerate(self.ColDefs):
+				x = t * (self.colCols + 1) + i
+				self.formatCol(x, cdef)
+				if cdef.bold:
+					self.setProps(
+						x, self.titlerows, x, self.titlerows + self.totalRows - 1,
+						style='PS Bold'
+					)
+			if t < self.cols-1:
+				self.colWidths[(t+1) * (self.colCols + 1) - 1] = 800
+
+	def setListLabels(self, *labels, cheight=14):
+		self.labelHeight = cheight
+		for i, l in enumerate(labels):
+			p = self.HeaderPositions[i]
+			self.cells[p.x + 1, p.y] = l
+			self.setProps(p.x + 1, p.y, p.x + 1, p.y, height=cheight, bold=True)
+
+	def setPageStyle(self, landscape=False, maxscale=True, pages=1, date=False):
+		self.page['landscape'] = landscape
+		if date:
+			self.page['date'] = datetime.date.today().strftime('%d.%m.%Y')
+		if maxscale:
+			self.page['scale'] = self.pageScale(landscape, pages, header=date)
+
+	def setHeaderRow(self, titles):
+		self.titles = tuple((t[1], t[2].height) for t in titles)
+		self.repeatRows = 1
+		for i in range(self.cols):
+			for pos, title, cdef in titles:
+				x = i * (self.colCols + 1) + pos
+				if title:
+					self.cells[x, 0] = title
+				props = {}
+				if cdef.bold:
+					props['bold'] = True
+				if cdef.height != 12:
+					props['height'] = cdef.height
+				if cdef.hcenter:
+					props['hjust'] = 'center'
+				self.setProps(x, 0, x, 0, **props)
+
+	def save(self, path):
+		"""Write the document of the sheet as .ods file to path"""
+		with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+			# The mimetype must come first, uncompressed
+			zf.writestr(
+				'mimetype', 'application/vnd.oasis.opendocument.spreadsheet',
+				compress_type=zipfile.ZIP_STORED
+			)
+			zf.writestr('META-INF/manifest.xml', Manifest)
+			zf.writestr('styles.xml', self.stylesXml())
+			with zf.open('content.xml', 'w') as f:
+				for chunk in self.contentXml():
+					f.write(chunk.encode('utf-8'))
+
+	def pageXml(self, layoutName):
+		"""Page layout and master page of the page style of the sheet"""
+		landscape = self.page['landscape']
+		width, height = (29700, 21000) if landscape else (21000, 29700)
+		date = self.page['date']
+		header = '<style:header-style><style:header-footer-properties' \
+			' fo:min-height="7.5mm" fo:margin-bottom="2.5mm"/></style:header-style>'
+		pageLayout = (
+			f'<style:page-layout style:name="{layoutName}">'
+			'<style:page-layout-properties'
+			f' fo:page-width="{mm(width)}" fo:page-height="{mm(height)}"'
+			f' style:print-orientation="{"landscape" if landscape else "portrait"}"'
+			f' fo:margin-top="5mm" fo:margin-bottom="5mm" fo:margin-left="5mm"'
+			f' fo:margin-right="5mm" style:table-centering="horizontal"'
+			f' style:scale-to="{self.page["scale"]}%"/>{header if date else ""}'
+			f'</style:page-layout>'
+		)
+		masterPage = (
+			f'<style:master-page style:name={quoteattr(self.pageStyle)}'
+			f' style:page-layout-name="{layoutName}">'
+			+ (
+				f'<style:header><style:region-left><text:p>{date}</text:p>'
+				f'</style:region-left></style:header>' if date else ''
+			) +
+			'</style:master-page>'
+		)
+		return pageLayout, masterPage
+
+	def stylesXml(self):
+		pages = [sheet.pageXml(f'Mpm{i+1}') for i, sheet in enumerate(self.sheets)]
+		return (
+			f'<?xml version="1.0" encoding="UTF-8"?>\n'
+			f'<office:document-styles {Namespaces} office:version="1.2">'
+			f'{FontFaces}{NamedStyles}<office:automatic-styles>'
+			+ ''.join(p[0] for p in pages) +
+			'</office:automatic-styles><office:master-styles>'
+			+ ''.join(p[1] for p in pages) +
+			'</office:master-styles></office:document-styles>'
+		)
+
+	def cellProps(self, x, y):
+		props = dict(self.colProps.get(x, ()))
+		props.update(self.props.get((x, y), ()))
+		return props
+
+	def tableStyles(self, styleName):
+		"""Names of the automatic styles of the columns, cells and rows
+
+		styleName(props, prefix) gives the name of a style.
+		"""
+		nrows = 1 + max(
+			[y for x, y in self.cells] + [y for x, y in self.props] +
+			[self.titlerows + self.totalRows - 1]
+		)
+		ncols = 1 + max(
+			[x for x, y in self.cells] + list(self.colWidths) + [self.totalCols - 1]
+		)
+		colStyles = [
+			(
+				styleName(dict(width=self.colWidths.get(x, DefaultWidth)), 'co'),
+				styleName(self.colProps[x], 'ce') if x in self.colProps else None
+			)
+			for x in range(ncols)
+		]
+		cellStyles = {
+			p: styleName(self.cellProps(*p), 'ce') for p in self.props
+		}
+		rowStyles = [
+			styleName(dict(height=self.heights.get(y), brk=y in self.breaks), 'ro')
+			for y in range(nrows)
+		]
+		return colStyles, cellStyles, rowStyles
+
+	def tableXml(self, tableStyle, colStyles, cellStyles, rowStyles):
+		"""The parts of the table of the sheet, the rows one by one"""
+		yield f'<table:table table:name={quoteattr(self.name)}' \
+			f' table:style-name="{tableStyle}">'
+		for co, ce in colStyles:
+			default = f' table:default-cell-style-name="{ce}"' if ce else ''
+			yield f'<table:table-column table:style-name="{co}"{default}/>'
+
+		covered = {(x, y + 1) for x, y in self.spans}
+		for y in range(len(rowStyles)):
+			if y == 0 and self.repeatRows:
+				yield '<table:table-header-rows>'
+			row = [f'<table:table-row table:style-name="{rowStyles[y]}">']
+			for x in range(len(colStyles)):
+				if (x, y) in covered:
+					row.append('<table:covered-table-cell/>')
+					continue
+				attrs = ''
+				if (x, y) in cellStyles:
+					attrs += f' table:style-name="{cellStyles[x, y]}"'
+				if (x, y) in self.spans:
+					attrs += f' table:number-rows-spanned="{self.spans[x, y]}"' \
+						' table:number-columns-spanned="1"'
+				val = self.cells.get((x, y))
+				if val is None:
+					row.append(f'<table:table-cell{attrs}/>')
+				elif isinstance(val, float):
+					row.append(
+						f'<table:table-cell{attrs} office:value-type="float"'
+						f' office:value="{val!r}"/>'
+					)
+				else:
+					lines = ''.join(
+						f'<text:p>{escape(line)}</text:p>'
+						for line in str(val).split('\n')
+					)
+					row.append(
+						f'<table:table-cell{attrs} office:value-type="string">'
+						f'{lines}</table:table-cell>'
+					)
+			row.append('</table:table-row>')
+			yield ''.join(row)
+			if y == self.repeatRows - 1:
+				yield '</table:table-header-rows>'
+		yield '</table:table>'
+
+	def contentXml(self):
+		"""The parts of content.xml, the rows one by one"""
+		styles = {}
+		counts = dict(co=0, ce=0, ro=0)
+
+		def styleName(props, prefix):
+			key = (prefix, tuple(sorted(props.items())))
+			if key not in styles:
+				counts[prefix] += 1
+				styles[key] = f'{prefix}{counts[prefix]}'
+			return styles[key]
+
+		# All automatic styles must be known before the first table
+		# starts, the sheets share them
+		tables = [sheet.tableStyles(styleName) for sheet in self.sheets]
+
+		yield f'<?xml version="1.0" encoding="UTF-8"?>\n' \
+			f'<office:document-content {Namespaces} office:version="1.2">' \
+			f'{FontFaces}<office:automatic-styles>'
+		for (prefix, props), name in styles.items():
+			props = dict(props)
+			if prefix == 'co':
+				width = mm(props['width'])
+				yield f'<style:style style:name="{name}"' \
+					' style:family="table-column"><style:table-column-properties' \
+					f' style:column-width="{width}"/></style:style>'
+			elif prefix == 'ro':
+				height = props['height']
+				size = f' style:row-height="{mm(height)}"' if height else ''
+				yield f'<style:style style:name="{name}" style:family="table-row">' \
+					f'<style:table-row-properties{size}' \
+					f' style:use-optimal-row-height="{"false" if height else "true"}"' \
+					f' fo:break-before="{"page" if props["brk"] else "auto"}"/></style:style>'
+			else:
+				yield cellStyleXml(name, props)
+		for i, sheet in enumerate(self.sheets):
+			yield f'<style:style style:name="ta{i+1}" style:family="table"' \
+				f' style:master-page-name={quoteattr(sheet.pageStyle)}>' \
+				'<style:table-properties table:display="true"/></style:style>'
+		yield '</office:automatic-styles><office:body><office:spreadsheet>'
+		for i, (sheet, table) in enumerate(zip(self.sheets, tables)):
+			yield from sheet.tableXml(f'ta{i+1}', *table)
+		yield '</office:spreadsheet></office:body></office:document-content>'
@@ -3,23 +3,82 @@
 Prepare an interactive python - libreoffice session
 """
 
+import subprocess
+import time
 import uno
 import types
+from com.sun.star.connection import NoConnectException
 
 
 class So(types.SimpleNamespace):
 	pass
 
 
-def init():
+class ScriptContext:
+	"""Stand-in for XSCRIPTCONTEXT outside of LibreOffice
+
+	Lets the macros in Psmacros run in a python process that talks to
+	LibreOffice over a socket.
+	"""
+
+	def __init__(self, ctx):
+		self.ctx = ctx
+		self.desktop = ctx.ServiceManager.createInstanceWithContext(
+			"com.sun.star.frame.Desktop", ctx
+		)
+
+	def getComponentContext(self):
+		return self.ctx
+
+	def getDesktop(self):
+		return self.desktop
+
+	def getDocument(self):
+		return self.desktop.getCurrentComponent()
+
+
+def start(
+	port=2002, host='localhost', headless=True, soffice='soffice', profile=None
+):
+	"""Start a LibreOffice process listening on host:port
+
+	profile is the directory of the user profile to use, needed when
+	several instances run at the same time.
+	"""
+	args = [
+		soffice, '--nologo', '--norestore', '--nodefault',
+		f'--accept=socket,host={host},port={port};urp;StarOffice.ComponentContext'
+	]
+	if headless:
+		args += ['--headless', '--invisible']
+	if profile is not None:
+		args.append('-env:UserInstallation=' + uno.systemPathToFileUrl(profile))
+	return subprocess.Popen(args)
+
+
+def connect(port=2002, host='localhost', timeout=0):
+	"""Get the component context of LibreOffice listening on host:port
+
+	Waits up to timeout seconds for LibreOffice to accept connections.
+	"""
 	localContext = uno.getComponentContext()
 	resolver = localContext.ServiceManager.createInstanceWithContext(
 		"com.sun.star.bridge.UnoUrlResolver",
 		localContext
 	)
-	ctx = resolver.resolve(
-		"uno:socket,host=localhost,port=2002;urp;StarOffice.ComponentContext"
-	)
+	deadline = time.monotonic() + timeout
+	while True:
+		try:
+			return resolver.resolve(
+				f"uno:socket,host={host},port={port};urp;StarOffice.ComponentContext"
+			)
+		except NoConnectException:
+			if time.monotonic() > deadline: raise
+			time.sleep(0.5)
+
+
+def init(port=2002, host='localhost'):
+	ctx = connect(port, host)
 	smgr = ctx.ServiceManager
 	desktop = smgr.createInstanceWithContext(
 		"com.sun.star.frame.Desktop", ctx
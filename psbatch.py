@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+"""
+Create report documents without the LibreOffice GUI
+
+Connects to (or starts) a headless LibreOffice, runs the report
+functions of Psmacros and exports every document they create to PDF
+or ODS. Must be run with a python that can import uno, e.g. the one
+shipped with LibreOffice, unless --direct is given: then the .ods
+files are written by python alone (see odsheet), and only converted
+to PDF by a single call of soffice.
+"""
+
+import argparse
+import ast
+import builtins
+import concurrent.futures
+import functools
+import hashlib
+import multiprocessing
+import multiprocessing.util
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+	import uno
+	from com.sun.star.beans import PropertyValue
+	from com.sun.star.connection import NoConnectException
+	from com.sun.star.lang import DisposedException
+	import offi
+except ImportError:
+	# Without the python of LibreOffice, only --direct works
+	uno = None
+
+import bodb
+import odsheet
+
+Filters = dict(pdf='calc_pdf_Export', ods='calc8')
+
+# The code the reports depend on, part of their fingerprints
+Sources = (
+	'Psmacros.py', 'bodb.py', 'layout.py', 'fontmetrics.py', 'odsheet.py',
+	'unores.py'
+)
+
+
+def loadMacros(ctx, mirror=None, timings=None):
+	"""Import Psmacros with an XSCRIPTCONTEXT for ctx
+
+	Calling it again switches the macros over to a new ctx. With
+	timings, the reports are profiled into that file, see psprof.
+	"""
+	builtins.XSCRIPTCONTEXT = offi.ScriptContext(ctx)
+	import Psmacros
+	Psmacros.mkcctx(ctx)
+	Psmacros.batchMode = True
+	# Over the socket, the queries may run while the macro waits
+	bodb.Workers = 3
+	if mirror is not None:
+		bodb.useMirror(mirror)
+	if timings is not None:
+		Psmacros.do_profile(timings)
+	return Psmacros
+
+
+def export(doc, path, fmt):
+	doc.storeToURL(
+		uno.systemPathToFileUrl(os.path.abspath(path)),
+		(PropertyValue(Name='FilterName', Value=Filters[fmt]),)
+	)
+
+
+@functools.lru_cache(maxsize=None)
+def codeVersion():
+	here = os.path.dirname(os.path.abspath(__file__))
+	h = hashlib.sha1()
+	for name in Sources:
+		with open(os.path.join(here, name), 'rb') as f:
+			h.update(f.read())
+	return h.hexdigest()
+
+
+def fingerprintPath(name, outdir):
+	return os.path.join(outdir, f'{name}.fingerprint')
+
+
+def runMacro(macros, name, outdir, fmt, skip):
+	"""Call the report function name
+
+	With skip, returns the fingerprint of the report, see
+	bodb.Fingerprint, or None if it is the one of the last run, whose
+	output is still in outdir. The report then stops before creating
+	its sheet. Without skip, returns ''.
+	"""
+	if not skip:
+		getattr(macros, name)()
+		return ''
+	path = fingerprintPath(name, outdir)
+	previous = None
+	document = os.path.join(outdir, f'{name}.{fmt}')
+	if os.path.exists(path) and os.path.exists(document):
+		with open(path) as f:
+			previous = f.read().strip()
+	fp = bodb.Fingerprint(previous, name, fmt, codeVersion())
+	bodb.useFingerprint(fp)
+	try:
+		getattr(macros, name)()
+	except bodb.Unchanged:
+		return None
+	finally:
+		bodb.useFingerprint(None)
+	return fp.hexdigest()
+
+
+def saveFingerprint(name, outdir, digest):
+	"""Keep the fingerprint of the output just written, see runMacro"""
+	if digest:
+		with open(fingerprintPath(name, outdir), 'w') as f:
+			f.write(digest + '\n')
+
+
+def runReport(macros, name, outdir, fmt, update=False, skip=False):
+	"""Run the report function name and export its documents
+
+	With update, the .ods of an earlier run in outdir is updated
+	instead of creating a new document (see Psmacros.Sheet.addData),
+	and always kept. For skip see runMacro. Returns the list of
+	files written, empty if the report did not change.
+	"""
+	del macros.documents[:]
+	previous = os.path.join(outdir, f'{name}.ods')
+	macros.toUpdate[:] = [previous] if update and os.path.exists(previous) else []
+	try:
+		digest = runMacro(macros, name, outdir, fmt, skip)
+	except Exception:
+		# The documents of a failed report are not exported
+		for doc in macros.documents:
+			doc.close(True)
+		del macros.documents[:]
+		raise
+	finally:
+		del macros.toUpdate[:]
+	if digest is None:
+		return []
+	formats = sorted({fmt, 'ods'}) if update else [fmt]
+	files = []
+	for i, doc in enumerate(macros.documents):
+		suffix = f'-{i+1}' if len(macros.documents) > 1 else ''
+		for f in formats:
+			path = os.path.join(outdir, f'{name}{suffix}.{f}')
+			export(doc, path, f)
+			files.append(path)
+		doc.close(True)
+	del macros.documents[:]
+	saveFingerprint(name, outdir, digest)
+	return files
+
+
+def loadDirect(mirror, timings=None):
+	"""Import Psmacros to write .ods files without LibreOffice"""
+	import Psmacros
+	Psmacros.useDirect()
+	Psmacros.batchMode = True
+	bodb.useMirror(mirror)
+	bodb.Workers = 3
+	if timings is not None:
+		Psmacros.do_profile(timings)
+	return Psmacros
+
+
+def saveDirect(name, outdir):
+	"""Save the sheets report name created with --direct as .ods
+
+	Returns the list of files written.
+	"""
+	files = []
+	for i, doc in enumerate(odsheet.documents):
+		suffix = f'-{i+1}' if len(odsheet.documents) > 1 else ''
+		path = os.path.join(outdir, f'{name}{suffix}.ods')
+		doc.save(path)
+		files.append(path)
+	del odsheet.documents[:]
+	return files
+
+
+def convert(files, fmt, outdir, soffice='soffice'):
+	"""Convert files with one headless soffice, returns the new files"""
+	subprocess.run(
+		[soffice, '--headless', '--convert-to', fmt, '--outdir', outdir, *files],
+		check=True, stdout=subprocess.DEVNULL
+	)
+	return [
+		os.path.join(outdir, os.path.splitext(os.path.basename(f))[0] + '.' + fmt)
+		for f in files
+	]
+
+
+def reportNames(selected):
+	"""Check the selected reports, default is all exported macros
+
+	Psmacros can only be imported with a LibreOffice at hand, so the
+	names are taken from its source.
+	"""
+	path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Psmacros.py')
+	with open(path, encoding='utf-8') as f:
+		tree = ast.parse(f.read())
+	names = next(
+		[e.id for e in node.value.elts]
+		for node in tree.body if isinstance(node, ast.Assign)
+		and getattr(node.targets[0], 'id', None) == 'g_exportedScripts'
+	)
+	for name in selected:
+		if name not in names:
+			sys.exit(f'Unknown report {name}, choose from: {" ".join(names)}')
+	return selected or names
+
+
+class Worker:
+	"""A LibreOffice process of our own for parallel runs
+
+	Each worker listens on its own port and uses its own copy of the
+	user profile given with --profile (where the data source bodb is
+	registered), as LibreOffice refuses to run twice on one profile.
+	"""
+
+	def __init__(self, port, args):
+		self.port = port
+		self.args = args
+		self.profile = os.path.join(args.workdir, f'profile{port}')
+		if args.profile and not os.path.exists(self.profile):
+			shutil.copytree(args.profile, self.profile)
+		self.proc = None
+		self.restart()
+
+	def restart(self):
+		self.stop()
+		self.proc = offi.start(
+			self.port, soffice=self.args.soffice, profile=self.profile
+		)
+		self.macros = loadMacros(
+			offi.connect(self.port, timeout=60), self.args.mirror, self.args.timings
+		)
+
+	def stop(self):
+		if self.proc is not None and self.proc.poll() is None:
+			self.proc.kill()
+			self.proc.wait()
+
+	def crashed(self, exc):
+		return isinstance(exc, DisposedException) or self.proc.poll() is not None
+
+	def run(self, name, outdir, fmt):
+		"""Run a report, restarting LibreOffice once if it crashed"""
+		try:
+			return runReport(
+				self.macros, name, outdir, fmt, self.args.update, self.args.skip_unchanged
+			)
+		except Exception as e:
+			if not self.crashed(e): raise
+			print(f'worker on port {self.port} crashed, restarting', file=sys.stderr)
+		self.restart()
+		return runReport(
+			self.macros, name, outdir, fmt, self.args.update, self.args.skip_unchanged
+		)
+
+
+# The Worker of a pool process
+worker = None
+
+
+def _initWorker(args, ports):
+	global worker
+	worker = Worker(ports.get(), args)
+	multiprocessing.util.Finalize(worker, worker.stop, exitpriority=10)
+
+
+def _runJob(name, outdir, fmt):
+	t = time.monotonic()
+	files = worker.run(name, outdir, fmt)
+	return files, time.monotonic() - t, worker.port
+
+
+def runParallel(names, args):
+	"""Distribute the reports over args.workers LibreOffice processes
+
+	Returns the sum of the times of the single reports. If a worker
+	process dies, the reports not done yet are run once more in a new
+	pool, on new ports. Those still not done then have failed.
+	"""
+	mp = multiprocessing.get_context('spawn')
+	busy = 0.0
+	pending = list(names)
+	# Why the reports in pending were not done, by name
+	broken = {}
+	attempts = 2
+	for attempt in range(attempts):
+		ports = mp.Queue()
+		for i in range(args.workers):
+			ports.put(args.port + 1 + attempt * args.workers + i)
+		with concurrent.futures.ProcessPoolExecutor(
+			args.workers, mp_context=mp,
+			initializer=_initWorker, initargs=(args, ports)
+		) as pool:
+			jobs = {
+				pool.submit(_runJob, name, args.outdir, args.format): name
+				for name in pending
+			}
+			for job in concurrent.futures.as_completed(jobs):
+				name = jobs[job]
+				try:
+					files, elapsed, port = job.result()
+				except concurrent.futures.process.BrokenProcessPool as e:
+					broken[name] = e
+					continue
+				except Exception as e:
+					failed(name, e)
+					pending.remove(name)
+					continue
+				busy += elapsed
+				pending.remove(name)
+				report(name, elapsed, files, port)
+		if not pending: break
+		if attempt < attempts - 1:
+			print(
+				f'worker pool broke, retrying {" ".join(pending)}', file=sys.stderr
+			)
+	for name in pending:
+		failed(name, broken[name])
+	return busy
+
+
+def runAllDirect(names, args):
+	"""Run the reports with --direct, returns the sum of their times
+
+	For PDF, the .ods files are written to a temporary directory and
+	converted all at once at the end. Only then the fingerprints are
+	saved, see runMacro.
+	"""
+	macros = loadDirect(args.mirror, args.timings)
+	busy = 0.0
+	digests = {}
+	with tempfile.TemporaryDirectory() as tmp:
+		odsdir = args.outdir if args.format == 'ods' else tmp
+		written = []
+		for name in names:
+			t = time.monotonic()
+			del odsheet.documents[:]
+			try:
+				digest = runMacro(
+					macros, name, args.outdir, args.format, args.skip_unchanged
+				)
+				files = [] if digest is None else saveDirect(name, odsdir)
+			except Exception as e:
+				failed(name, e)
+				continue
+			busy += time.monotonic() - t
+			written += files
+			digests[name] = digest
+			report(name, time.monotonic() - t, files)
+		if args.format != 'ods' and written:
+			t = time.monotonic()
+			files = convert(written, args.format, args.outdir, args.soffice)
+			print(f'{"conversion":24} {time.monotonic() - t:7.2f}s  {" ".join(files)}')
+	for name, digest in digests.items():
+		if digest is not None:
+			saveFingerprint(name, args.outdir, digest)
+	return busy
+
+
+# Reports whose output changed in this run, see report
+reprint = []
+
+
+def report(name, elapsed, files, port=None):
+	"""Print how report name went, files is empty if it did not change"""
+	where = f'  [{port}]' if port is not None else ''
+	if files:
+		reprint.append(name)
+	print(f'{name:24} {elapsed:7.2f}s{where}  {" ".join(files) or "unchanged"}')
+
+
+# Reports that failed, see failed
+failures = []
+
+
+def failed(name, exc):
+	"""Print that report name failed with exc, the others go on"""
+	failures.append(name)
+	print(f'{name:24} failed: {type(exc).__name__}: {exc}')
+
+
+def attach(args):
+	"""Connect to LibreOffice, starting it if necessary"""
+	try:
+		return offi.connect(args.port)
+	except NoConnectException:
+		if not args.start: raise
+	offi.start(args.port, soffice=args.soffice)
+	return offi.connect(args.port, timeout=60)
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+	parser.add_argument(
+		'reports', nargs='*', help='reports to create, default all'
+	)
+	parser.add_argument('-f', '--format', choices=Filters, default='pdf')
+	parser.add_argument('-o', '--outdir', default='.')
+	parser.add_argument('-p', '--port', type=int, default=2002)
+	parser.add_argument(
+		'-s', '--start', action='store_true',
+		help='start a headless LibreOffice if none is listening on port'
+	)
+	parser.add_argument('--soffice', default='soffice')
+	parser.add_argument('-m', '--mirror', help='query this SQLite mirror instead')
+	parser.add_argument(
+		'-u', '--update', action='store_true',
+		help='update the .ods of the last run in outdir if only values changed'
+	)
+	parser.add_argument(
+		'-t', '--timings', metavar='FILE',
+		help='append phase timings and UNO call counts of each report to FILE'
+		' as JSON lines'
+	)
+	parser.add_argument(
+		'--skip-unchanged', action='store_true',
+		help='keep the output of reports whose data and layout did not change'
+	)
+	parser.add_argument(
+		'-d', '--direct', action='store_true',
+		help='write .ods files without LibreOffice, needs --mirror'
+	)
+	parser.add_argument(
+		'-w', '--workers', type=int, default=1,
+		help='run reports in parallel in this many LibreOffice processes,'
+		' listening on the ports following --port'
+	)
+	parser.add_argument(
+		'--profile',
+		help='user profile to copy for each worker, needs bodb registered'
+	)
+	parser.add_argument(
+		'--workdir', default=os.path.join(tempfile.gettempdir(), 'psbatch'),
+		help='where the worker profiles are kept'
+	)
+	parser.add_argument(
+		'--write-template', metavar='FILE',
+		help='only save the report template with the named styles to FILE'
+	)
+	args = parser.parse_args()
+	if args.write_template:
+		loadMacros(attach(args)).writeTemplate(args.write_template)
+		return
+	args.outdir = os.path.abspath(args.outdir)
+	os.makedirs(args.outdir, exist_ok=True)
+
+	start = time.monotonic()
+	if args.direct:
+		if not args.mirror:
+			parser.error('--direct needs --mirror')
+		busy = runAllDirect(reportNames(args.reports), args)
+	elif args.workers > 1:
+		busy = runParallel(reportNames(args.reports), args)
+	else:
+		macros = loadMacros(attach(args), args.mirror, args.timings)
+		busy = 0.0
+		for name in reportNames(args.reports):
+			t = time.monotonic()
+			try:
+				files = runReport(
+					macros, name, args.outdir, args.format, args.update,
+					args.skip_unchanged
+				)
+			except Exception as e:
+				failed(name, e)
+				continue
+			busy += time.monotonic() - t
+			report(name, time.monotonic() - t, files)
+	print(f'{"total":24} {time.monotonic() - start:7.2f}s  (reports {busy:.2f}s)')
+	if args.skip_unchanged:
+		print(f'{"to reprint":24} {" ".join(reprint) or "none"}')
+	if failures:
+		print(f'{"failed":24} {" ".join(failures)}')
+		sys.exit(1)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+Benchmark the reports without LibreOffice and database
+
+Runs the exported macros of Psmacros against a synthetic SQLite
+mirror of V_Artikelinfo (see bodb.useMirror) with 100 up to 100000
+articles, and against stand-ins for uno and the calc documents that
+only count the calls over the bridge. For every report and size the
+time, the number of bridge calls and the peak memory are printed.
+The time includes latency per bridge call (--latency), as the calls
+of a real LibreOffice cost far more than those of the stand-ins.
+
+With --save the results are kept as baseline, with --baseline they
+are compared to one, and the exit status is 1 if a report got slower,
+makes more bridge calls or needs more memory than allowed. The bridge
+calls of the stand-ins are the same on every machine, psbench.json
+holds them for 100 to 10000 articles.
+"""
+
+import argparse
+import builtins
+import functools
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+import bodb
+
+Sizes = (100, 1000, 10000, 100000)
+
+
+class Bridge:
+	"""Calls made over the pretended bridge"""
+
+	def __init__(self):
+		self.calls = 0
+
+
+bridge = Bridge()
+
+# Values of properties that are read before they are set
+Defaults = dict(
+	Width=2258, Height=452, Sheet=0, PageStyle='PS Report', ElementNames=()
+)
+
+# Results of methods, by name, default is another Stub
+Results = dict(
+	hasByName=lambda *a: False,
+	hasPropertyByName=lambda *a: False,
+	getStandardFormat=lambda *a: 0,
+	getDataArray=lambda *a: (),
+	**{
+		name: lambda *a: None for name in (
+			'addProperty', 'addRangeAddresses', 'close', 'insertByName', 'merge',
+			'setDataArray', 'setTitleRows', 'storeToURL',
+		)
+	}
+)
+
+
+class Stub:
+	"""Stand-in for any UNO object, counting calls over the bridge
+
+	As in the UNO API, capitalized names are properties and the others
+	methods. Properties keep what was set and default to Defaults or
+	another Stub, methods return Results or another Stub. Each
+	property access and method call counts as one call.
+	"""
+
+	__slots__ = ('_name', '_props')
+
+	def __init__(self, name='Stub'):
+		object.__setattr__(self, '_name', name)
+		object.__setattr__(self, '_props', {})
+
+	def __getattr__(self, name):
+		if name[0].islower():
+			return functools.partial(self._call, name)
+		bridge.calls += 1
+		if name not in self._props:
+			self._props[name] = Defaults.get(name, Stub(name))
+		return self._props[name]
+
+	def __setattr__(self, name, value):
+		bridge.calls += 1
+		self._props[name] = value
+
+	def _call(self, name, *args):
+		bridge.calls += 1
+		result = Results.get(name)
+		return Stub(name) if result is None else result(*args)
+
+	def __repr__(self):
+		return f'Stub({self._name})'
+
+
+class ScriptContext:
+	"""Stand-in for XSCRIPTCONTEXT"""
+
+	def __init__(self):
+		self.ctx = Stub('ComponentContext')
+		self.desktop = Stub('Desktop')
+
+	def getComponentContext(self):
+		return self.ctx
+
+	def getDesktop(self):
+		return self.desktop
+
+	def getDocument(self):
+		return self.desktop.getCurrentComponent()
+
+
+class Struct(types.SimpleNamespace):
+	"""Stand-in for UNO structs, which live on the python side"""
+
+	def __init__(self, *args, **kw):
+		super().__init__(args=args, **kw)
+
+
+def installUno():
+	"""Put stand-ins for uno and the com.sun.star modules in place"""
+	modules = {}
+	for name in (
+		'uno', 'com', 'com.sun', 'com.sun.star', 'com.sun.star.beans',
+		'com.sun.star.lang', 'com.sun.star.table',
+	):
+		modules[name] = sys.modules[name] = types.ModuleType(name)
+	uno = modules['uno']
+	uno.getConstantByName = lambda name: 150
+	uno.createUnoStruct = lambda name: Struct()
+	uno.Enum = lambda typeName, value: value
+	uno.systemPathToFileUrl = lambda path: 'file://' + path
+	uno.fileUrlToSystemPath = lambda url: url[len('file://'):]
+	modules['com.sun.star.beans'].PropertyValue = Struct
+	modules['com.sun.star.lang'].Locale = Struct
+	modules['com.sun.star.table'].CellRangeAddress = Struct
+	modules['com.sun.star.table'].CellAddress = Struct
+
+
+# Values of the synthetic articles, chosen so that every report finds
+# lists growing with the number of articles
+Locations = [
+	'Apfel', 'Kartoffel', 'Knoblauch', 'kühl links', 'kühl rechts', 'Pilze',
+	'Zitrone', 'Zwiebel', '1Mopro', '2Mopro', '3Mix', '4Vegan', '5Fleisch', 'HH'
+]
+Groups = [
+	'0001', '0003', '0020', '0025', '0060', '0070', '0090', '0200', '0280',
+	'0340', '0400', '0585', '0590'
+]
+Suppliers = ['SCHÄFERBROT', 'WEBER', 'FAUSER', 'UNTERWEGER', 'URIA', 'ANDERE']
+Units = ['kg', 'Kg', 'St', 'Bd', '100g', 'Stk']
+Words = [
+	'Äpfel', 'Birnen', 'Brot', 'Brötchen', 'Käse', 'Joghurt', 'Möhren', 'Salat',
+	'Bio', 'lose', 'Sorte', 'groß', 'Demeter', 'Vollkorn', 'Dinkel', 'Roggen'
+]
+
+
+def makeMirror(path, n, seed=0):
+	"""Write a mirror with n synthetic articles to path"""
+	rnd = random.Random(seed)
+	if os.path.exists(path): os.remove(path)
+	db = sqlite3.connect(path)
+	db.create_collation('BODB', bodb._collate)
+	db.execute('CREATE TABLE V_Artikelinfo ({})'.format(', '.join(
+		f'{c} REAL' if t == 'D' else f'{c} TEXT COLLATE BODB'
+		for c, t in bodb.MirrorCols.items()
+	)))
+
+	def article(i):
+		vk1 = round(rnd.uniform(0.2, 30), 2)
+		return dict(
+			WG=rnd.choice(Groups), EAN=str(4000000000000 + i),
+			Bezeichnung=' '.join(rnd.sample(Words, rnd.randint(1, 4))) + f' {i}',
+			VKEinheit=rnd.choice(Units), Wiegeartikel='',
+			Land=rnd.choice(['DE', 'IT', 'ES']),
+			iWG=rnd.choice(Locations), LiefID=rnd.choice(Suppliers), ArtNr=str(i),
+			EK0=vk1 * 0.7, VKGH=vk1, Hersteller=rnd.choice(['Hof Sonne', 'Mühle']),
+			VK1=vk1, VK0=round(vk1 * 1.2, 2), MwSt=7.0, LadenID='PLATTSALAT',
+			Waage=rnd.choice('AB'),
+		)
+	db.executemany('INSERT INTO V_Artikelinfo VALUES ({})'.format(
+		','.join('?' for c in bodb.MirrorCols)
+	), (tuple(article(i).values()) for i in range(n)))
+	for c in ('WG', 'iWG', 'LiefID', 'Waage'):
+		db.execute(f'CREATE INDEX idx_{c} ON V_Artikelinfo ({c})')
+	db.commit()
+	db.close()
+
+
+def loadMacros(direct):
+	if not direct:
+		installUno()
+		builtins.XSCRIPTCONTEXT = ScriptContext()
+	import Psmacros
+	Psmacros.batchMode = True
+	return Psmacros
+
+
+def resetCaches(macros):
+	"""Forget what earlier reports measured, as in a new process"""
+	import fontmetrics
+	import layout
+	import odsheet
+	for cls in (macros.UnoSheet, odsheet.OdsSheet):
+		cls.rowHeights.clear()
+	layout.planData.cache_clear()
+	layout.planPagelist.cache_clear()
+	fontmetrics.textWidth.cache_clear()
+
+
+def runReport(macros, name):
+	import odsheet
+	getattr(macros, name)()
+	del macros.documents[:]
+	del odsheet.documents[:]
+
+
+def measure(macros, names, latency):
+	"""Time, bridge calls and peak memory of each report in names"""
+	results = {}
+	for name in names:
+		calls = bridge.calls
+		t = time.perf_counter()
+		try:
+			runReport(macros, name)
+		except Exception as e:
+			# E.g. all lists empty, with few articles
+			results[name] = dict(error=f'{type(e).__name__}: {e}')
+			continue
+		elapsed = time.perf_counter() - t
+		calls = bridge.calls - calls
+		# A second run for the memory, tracemalloc slows it down. It
+		# starts cold as well, otherwise what the first run cached
+		# would not count.
+		resetCaches(macros)
+		tracemalloc.start()
+		runReport(macros, name)
+		peak = tracemalloc.get_traced_memory()[1]
+		tracemalloc.stop()
+		results[name] = dict(
+			time=round(elapsed + calls * latency, 4), calls=calls, peak=peak
+		)
+	return results
+
+
+def regressions(results, baseline, tolerance):
+	"""Compare results to baseline, returns the list of regressions
+
+	tolerance maps each measure to the allowed relative increase.
+	Measures missing from the baseline are not compared.
+	"""
+	found = []
+	for size, reports in results.items():
+		for name, r in reports.items():
+			base = baseline.get(size, {}).get(name)
+			if base is None or 'error' in base: continue
+			if 'error' in r:
+				found.append(f'{name} ({size} articles): {r["error"]}')
+				continue
+			for key, allowed in tolerance.items():
+				if key in base and r[key] > base[key] * (1 + allowed):
+					found.append(
+						f'{name} ({size} articles): {key} {base[key]} -> {r[key]}'
+					)
+	return found
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+	parser.add_argument('reports', nargs='*', help='reports to run, default all')
+	parser.add_argument(
+		'-n', '--sizes', default=Sizes,
+		type=lambda s: [int(n) for n in s.split(',')],
+		help='numbers of articles to run the reports with, separated by commas'
+	)
+	parser.add_argument(
+		'-l', '--latency', type=float, default=0.0002,
+		help='seconds added for each call over the bridge'
+	)
+	parser.add_argument(
+		'-d', '--direct', action='store_true',
+		help='use the sheets of odsheet instead of LibreOffice stand-ins'
+	)
+	parser.add_argument(
+		'-b', '--baseline', help='compare to the results in this file'
+	)
+	parser.add_argument('-s', '--save', help='save the results to this file')
+	parser.add_argument(
+		'--calls-only', action='store_true',
+		help='save only the bridge calls, which do not depend on the machine'
+	)
+	parser.add_argument(
+		'--time-tolerance', type=float, default=0.5,
+		help='allowed relative increase of the time'
+	)
+	parser.add_argument(
+		'--memory-tolerance', type=float, default=0.25,
+		help='allowed relative increase of the peak memory'
+	)
+	parser.add_argument('--workdir', default=tempfile.gettempdir())
+	args = parser.parse_args()
+
+	macros = loadMacros(args.direct)
+	print(
+		f'import Psmacros {macros.importTime:8.3f}s'
+		f' (budget {macros.ImportBudget}s)'
+	)
+	names = args.reports or [f.__name__ for f in macros.g_exportedScripts]
+	results = {}
+	for n in args.sizes:
+		path = os.path.join(args.workdir, f'psbench{n}.sqlite')
+		makeMirror(path, n)
+		bodb.useMirror(path)
+		# The connection of the last size is still pooled
+		bodb.pool.clear()
+		resetCaches(macros)
+		results[str(n)] = measure(macros, names, args.latency)
+		for name, r in results[str(n)].items():
+			if 'error' in r:
+				print(f'{n:>7} {name:24} {r["error"]}')
+				continue
+			print(
+				f'{n:>7} {name:24} {r["time"]:8.3f}s {r["calls"]:8} calls'
+				f' {r["peak"] / 1e6:8.1f} MB'
+			)
+	if args.save:
+		saved = results
+		if args.calls_only:
+			saved = {
+				size: {
+					name: {k: v for k, v in r.items() if k in ('calls', 'error')}
+					for name, r in reports.items()
+				}
+				for size, reports in results.items()
+			}
+		with open(args.save, 'w') as f:
+			json.dump(saved, f, indent=1)
+	found = []
+	if macros.importTime > macros.ImportBudget:
+		found.append(f'import of Psmacros: {macros.importTime:.3f}s')
+	if args.baseline:
+		with open(args.baseline) as f:
+			baseline = json.load(f)
+		found += regressions(results, baseline, dict(
+			time=args.time_tolerance, calls=0, peak=args.memory_tolerance
+		))
+	for r in found:
+		print('regression:', r)
+	if found:
+		sys.exit(1)
+
+
+if __name__ == '__main__':
+	main()
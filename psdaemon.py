@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Run the reports of the menu in a long-lived worker process
+
+Every click on a macro otherwise starts from scratch: the script
+provider imports Psmacros, the database is connected and the caches
+(query results, row heights, plans) are empty. The worker connects to
+the LibreOffice of the user once, over the socket LibreOffice accepts
+connections on (see offi), and keeps all of this alive. The macros
+hand their report to the worker over a local socket (see submit), which
+then creates the document in the user's LibreOffice, as the macro would
+have done. When no worker is running, the macros run the report
+themselves.
+"""
+
+import argparse
+import json
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import time
+import traceback
+
+# Port the worker takes jobs on
+Port = 2003
+
+# Seconds a macro waits for the worker before running the report itself
+Timeout = 1.0
+
+
+def submit(name, port=Port, host='localhost'):
+	"""Queue the report name in the worker, returns its place in the queue
+
+	Only waits until the job is queued: LibreOffice is busy with the
+	macro calling this until it returns, so the worker could not
+	create the document before. Raises OSError if no worker is there,
+	ValueError if it does not know the report.
+	"""
+	with socket.create_connection((host, port), timeout=Timeout) as conn:
+		conn.sendall(json.dumps(dict(report=name)).encode() + b'\n')
+		reply = json.loads(conn.makefile('rb').readline() or b'{}')
+	if 'queued' not in reply:
+		raise ValueError(reply.get('error', 'No reply from the worker'))
+	return reply['queued']
+
+
+class Handler(socketserver.StreamRequestHandler):
+	"""Take one job from a macro, see submit"""
+
+	def handle(self):
+		try:
+			name = json.loads(self.rfile.readline())['report']
+			if name not in self.server.worker.names:
+				raise ValueError(f'Unknown report {name}')
+		except Exception as e:
+			reply = dict(error=str(e))
+		else:
+			reply = dict(queued=self.server.worker.jobs.qsize())
+			self.server.worker.jobs.put(name)
+		self.wfile.write(json.dumps(reply).encode() + b'\n')
+
+
+class Server(socketserver.ThreadingTCPServer):
+	allow_reuse_address = True
+	daemon_threads = True
+
+
+class Daemon:
+	"""The worker, running the queued reports one after the other"""
+
+	def __init__(self, args):
+		self.args = args
+		self.jobs = queue.Queue()
+		self.connect()
+		self.names = {f.__name__ for f in self.macros.g_exportedScripts}
+
+	def connect(self):
+		import offi
+		import psbatch
+		self.macros = psbatch.loadMacros(
+			offi.connect(self.args.port, timeout=self.args.wait),
+			self.args.mirror, self.args.timings
+		)
+		# The documents are for the user, and the reports must not be
+		# handed back to this worker
+		self.macros.batchMode = False
+		self.macros.WorkerPort = None
+
+	def run(self, name):
+		"""Run report name, reconnecting once if LibreOffice went away"""
+		from com.sun.star.lang import DisposedException
+		try:
+			getattr(self.macros, name)()
+		except DisposedException:
+			print('LibreOffice went away, reconnecting', file=sys.stderr)
+			self.connect()
+			getattr(self.macros, name)()
+
+	def work(self):
+		while True:
+			name = self.jobs.get()
+			t = time.monotonic()
+			try:
+				self.run(name)
+			except Exception:
+				print(f'{name:24} failed', file=sys.stderr)
+				traceback.print_exc()
+			else:
+				print(f'{name:24} {time.monotonic() - t:7.2f}s', flush=True)
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+	parser.add_argument(
+		'-p', '--port', type=int, default=2002,
+		help='port LibreOffice accepts connections on'
+	)
+	parser.add_argument(
+		'-l', '--listen', type=int, default=Port,
+		help='port to take jobs on, PS_WORKER_PORT of LibreOffice must match'
+	)
+	parser.add_argument(
+		'--wait', type=float, default=60,
+		help='seconds to wait for LibreOffice to accept connections'
+	)
+	parser.add_argument('-m', '--mirror', help='query this SQLite mirror instead')
+	parser.add_argument(
+		'-t', '--timings', metavar='FILE',
+		help='append phase timings and UNO call counts of each report to FILE'
+		' as JSON lines'
+	)
+	args = parser.parse_args()
+
+	daemon = Daemon(args)
+	with Server(('localhost', args.listen), Handler) as server:
+		server.worker = daemon
+		threading.Thread(target=server.serve_forever, daemon=True).start()
+		print(f'taking jobs on port {args.listen}', flush=True)
+		try:
+			daemon.work()
+		except KeyboardInterrupt:
+			pass
+		server.shutdown()
+
+
+if __name__ == '__main__':
+	main()
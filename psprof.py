@@ -0,0 +1,309 @@
+"""Where the time of the reports goes
+
+Opt-in profiling, see Psmacros.do_profile. The functions doing the
+phases of a report (queries, fetching rows, filling, formatting and
+scaling the sheet) are wrapped to record their wall time, the rows
+they handled and the calls over the UNO bridge they made. Each report
+run logs one JSON line to the logger libreoffice.profile, a child of
+the one of do_log.
+
+Phases may nest (a query fetches rows), their times include those of
+the phases within. Calls over the bridge are counted by proxies for
+the UNO objects the reports get from XSCRIPTCONTEXT and bodb.CC, per
+thread: the calls of a phase are those of the thread running it.
+Queries submitted to the threads of bodb (see bodb.submit) overlap
+the phases of the report itself, so the times of the phases may add
+up to more than that of the report.
+"""
+import builtins
+import collections
+import datetime
+import functools
+import inspect
+import json
+import logging
+import threading
+import time
+
+import bodb
+import layout
+import odsheet
+
+log = logging.getLogger('libreoffice.profile')
+
+# Calls over the UNO bridge so far, made through Counted proxies, one
+# counter per thread, see calls
+_counters = []
+
+
+class _Calls(threading.local):
+	def __init__(self):
+		self.counter = [0]
+		_counters.append(self.counter)
+
+
+_calls = _Calls()
+
+
+def calls():
+	"""Calls over the bridge this thread made so far"""
+	return _calls.counter[0]
+
+
+def totalCalls():
+	"""Calls over the bridge all threads made so far"""
+	return sum(counter[0] for counter in _counters)
+
+
+# Type names of python objects standing for UNO objects
+UnoTypes = {'pyuno', 'PyUNO'}
+
+
+def isUno(value):
+	return type(value).__name__ in UnoTypes
+
+
+def wrap(value):
+	if isUno(value):
+		return Counted(value)
+	if isinstance(value, tuple) and value and isUno(value[0]):
+		return tuple(wrap(v) for v in value)
+	return value
+
+
+def unwrap(value):
+	if isinstance(value, Counted):
+		return value._target
+	if isinstance(value, tuple) and value and isinstance(value[0], Counted):
+		return tuple(unwrap(v) for v in value)
+	return value
+
+
+def _call(method, *args):
+	_calls.counter[0] += 1
+	return wrap(method(*(unwrap(a) for a in args)))
+
+
+class Counted:
+	"""Proxy for a UNO object, counting the calls over the bridge
+
+	Getting or setting a property and calling a method is one call
+	each. UNO objects returned are proxied as well.
+	"""
+
+	__slots__ = ('_target',)
+
+	def __init__(self, target):
+		object.__setattr__(self, '_target', target)
+
+	def __getattr__(self, name):
+		value = getattr(self._target, name)
+		if callable(value):
+			return functools.partial(_call, value)
+		_calls.counter[0] += 1
+		return wrap(value)
+
+	def __setattr__(self, name, value):
+		_calls.counter[0] += 1
+		setattr(self._target, name, unwrap(value))
+
+	def __eq__(self, other):
+		return self._target == unwrap(other)
+
+	def __hash__(self):
+		return hash(self._target)
+
+	def __repr__(self):
+		return f'Counted({self._target!r})'
+
+
+class ScriptContext:
+	"""Stand-in for XSCRIPTCONTEXT handing out Counted proxies"""
+
+	def __init__(self, real):
+		self.real = real
+
+	def getComponentContext(self):
+		return wrap(self.real.getComponentContext())
+
+	def getDesktop(self):
+		return wrap(self.real.getDesktop())
+
+	def getDocument(self):
+		return wrap(self.real.getDocument())
+
+
+class Report:
+	"""The phases of one run of a report"""
+
+	def __init__(self, name):
+		self.name = name
+		self.phases = collections.defaultdict(
+			lambda: dict(calls=0, time=0.0, rows=0, uno=0)
+		)
+		# Phases being run, by thread, calls within them are not
+		# counted twice
+		self.active = set()
+
+	def record(self):
+		return dict(report=self.name, phases={
+			name: dict(p, time=round(p['time'], 4))
+			for name, p in self.phases.items()
+		})
+
+
+# The report being run
+current = None
+
+
+def _timedRows(report, name, rows):
+	"""Iterate over rows, adding the time taken to phase name"""
+	p = report.phases[name]
+	while True:
+		t, n = time.perf_counter(), calls()
+		try:
+			row = next(rows)
+		except StopIteration:
+			return
+		finally:
+			p['time'] += time.perf_counter() - t
+			p['uno'] += calls() - n
+		p['rows'] += 1
+		yield row
+
+
+def phase(name, rows=None):
+	"""Decorator recording the calls of a function as phase name
+
+	rows(result, args) tells how many rows a call handled. Results
+	that are generators are timed while they are iterated over, each
+	item counting as a row.
+	"""
+	def decorate(func):
+		@functools.wraps(func)
+		def wrapper(*args, **kw):
+			report = current
+			active = (threading.get_ident(), name)
+			if report is None or active in report.active:
+				return func(*args, **kw)
+			report.active.add(active)
+			p = report.phases[name]
+			t, n = time.perf_counter(), calls()
+			try:
+				result = func(*args, **kw)
+			finally:
+				report.active.discard(active)
+				p['calls'] += 1
+				p['time'] += time.perf_counter() - t
+				p['uno'] += calls() - n
+			if inspect.isgenerator(result):
+				return _timedRows(report, name, result)
+			if rows is not None:
+				p['rows'] += rows(result, args)
+			return result
+		wrapper.profiled = True
+		return wrapper
+	return decorate
+
+
+def profiled(func):
+	"""Run the report function func as a Report, logging its phases"""
+	@functools.wraps(func)
+	def run(*args):
+		global current
+		current = Report(func.__name__)
+		started = datetime.datetime.now().isoformat(timespec='seconds')
+		t, n = time.perf_counter(), totalCalls()
+		try:
+			return func(*args)
+		finally:
+			record = current.record()
+			current = None
+			record.update(
+				started=started, time=round(time.perf_counter() - t, 4),
+				uno=totalCalls() - n
+			)
+			log.info(json.dumps(record))
+	run.profiled = True
+	return run
+
+
+def resultRows(result, args):
+	return len(result)
+
+
+def batchRows(result, args):
+	return sum(len(r) for r in result)
+
+
+def columnRows(result, args):
+	return len(result[0]) if result else 0
+
+
+def listRows(result, args):
+	return sum(len(ll) for ll in args[1:])
+
+
+def patch(cls, name, phaseName, rows=None):
+	"""Wrap the method name of cls, if cls defines it, see phase"""
+	raw = cls.__dict__.get(name)
+	if raw is None:
+		return
+	if isinstance(raw, classmethod):
+		if not getattr(raw.__func__, 'profiled', False):
+			setattr(cls, name, classmethod(phase(phaseName, rows)(raw.__func__)))
+	elif not getattr(raw, 'profiled', False):
+		setattr(cls, name, phase(phaseName, rows)(raw))
+
+
+def enable(ns, path=None):
+	"""Profile the reports exported by the macro module with globals ns
+
+	The JSON lines are appended to the file path, otherwise they go
+	to the log of do_log. May be called again, e.g. for a new
+	XSCRIPTCONTEXT.
+	"""
+	if path is not None and not log.handlers:
+		handler = logging.FileHandler(path)
+		handler.setFormatter(logging.Formatter('%(message)s'))
+		log.addHandler(handler)
+		log.propagate = False
+	log.setLevel(logging.INFO)
+
+	for cls in (bodb.Query,):
+		patch(cls, 'run', 'query', resultRows)
+		patch(cls, 'runColumns', 'query', columnRows)
+		patch(cls, 'runBatch', 'query', batchRows)
+	for cls in (bodb.BioOfficeConn, bodb.MirrorConn):
+		patch(cls, 'fetch', 'fetch')
+		patch(cls, 'queryResult', 'check', resultRows)
+	for cls in (layout.BaseSheet, ns['UnoSheet'], odsheet.OdsSheet):
+		patch(cls, '__init__', 'newSheet')
+		patch(cls, 'addData', 'addData', listRows)
+		patch(cls, 'addPagelist', 'addPagelist', listRows)
+		patch(cls, 'streamPagelist', 'addPagelist')
+		patch(cls, 'formatColumns', 'formatColumns')
+		patch(cls, 'setListLabels', 'setListLabels')
+		patch(cls, 'setHeaderRow', 'setHeaderRow')
+		patch(cls, 'setPageStyle', 'setPageStyle')
+		patch(cls, 'getOptimalScale', 'scale')
+		patch(cls, 'getOptimalScaleExt', 'scale')
+		patch(cls, 'rowRuns', 'rowHeights')
+
+	exported = []
+	for func in ns['g_exportedScripts']:
+		if not getattr(func, 'profiled', False):
+			func = ns[func.__name__] = profiled(func)
+		exported.append(func)
+	ns['g_exportedScripts'][:] = exported
+
+	# psbatch provides the context as builtin, LibreOffice in ns
+	ctx = getattr(builtins, 'XSCRIPTCONTEXT', None) or ns.get('XSCRIPTCONTEXT')
+	if ctx is not None:
+		if isinstance(ctx, ScriptContext):
+			ctx = ctx.real
+		ns['XSCRIPTCONTEXT'] = ScriptContext(ctx)
+	if bodb.CC is not None and not isinstance(bodb.CC, Counted):
+		# Connections made so far would not be counted
+		bodb.pool.clear()
+		bodb.CC = Counted(bodb.CC)
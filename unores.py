@@ -0,0 +1,61 @@
+"""UNO constants, enums and structs of the reports, resolved lazily
+
+Looking these up goes over the bridge (or through the import hook of
+pyuno), which made every import of Psmacros and every new sheet slow.
+They do not change while LibreOffice runs, so each is resolved once
+per process, when first needed, and then shared. Living in pythonpath,
+the values outlive reloads of Psmacros as well.
+"""
+import functools
+
+# Locale of the number formats
+Locale = ('de', 'DE', '')
+
+
+@functools.lru_cache(maxsize=None)
+def constant(name):
+	"""Value of a UNO constant, e.g. com.sun.star.awt.FontWeight.BOLD"""
+	import uno
+	return uno.getConstantByName(name)
+
+
+@functools.lru_cache(maxsize=None)
+def enum(typeName, value):
+	import uno
+	return uno.Enum(typeName, value)
+
+
+def fontWeight(name='BOLD'):
+	return constant('com.sun.star.awt.FontWeight.' + name)
+
+
+def horiJustify(name):
+	return enum('com.sun.star.table.CellHoriJustify', name)
+
+
+def vertJustify(name):
+	return enum('com.sun.star.table.CellVertJustify', name)
+
+
+@functools.lru_cache(maxsize=None)
+def borderLine(width=5):
+	"""A BorderLine2 of width, shared by all callers, so never change it
+
+	Assigning a struct to a property copies it, one is enough.
+	"""
+	import uno
+	line = uno.createUnoStruct('com.sun.star.table.BorderLine2')
+	line.OuterLineWidth = width
+	return line
+
+
+def numberFormat(calc, kind='CURRENCY', locale=Locale):
+	"""Key of the standard number format kind in the document calc
+
+	The keys are those of the document's own number formats. They are
+	not memoised, as that would keep the closed documents alive.
+	"""
+	from com.sun.star.lang import Locale as UnoLocale
+	return calc.NumberFormats.getStandardFormat(
+		constant('com.sun.star.util.NumberFormat.' + kind), UnoLocale(*locale)
+	)